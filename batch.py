@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# vim:set sts=4 et sw=4 ts=4 ci ai:
+"""
+batch.py -- simulate many headless Monsters and Mushrooms games
+across all CPU cores and summarize the results.
+
+Every game is seeded (first seed + game number) so any single game of
+a batch can be reproduced with: game.py --headless --seed N
+
+usage: batch.py [-n GAMES] [-p POLICY] [-j JOBS] [--json FILE]
+"""
+
+import json
+import multiprocessing
+import optparse
+import os
+import time
+
+import game as mm
+
+# input policies by name, each takes the game seed
+POLICIES = {
+    'idle' : lambda seed: None,
+    'random' : lambda seed: mm.RandomPolicy(seed),
+    'scripted' : lambda seed: mm.ScriptedPolicy(),
+    'greedy' : lambda seed: mm.GreedyShooter(),
+    'dodger' : lambda seed: mm.Dodger(),
+}
+
+
+def play(task):
+    """Play one headless game, task is (seed, policy, max_frames)."""
+    (seed, policy, max_frames) = task
+    # a fresh Game for every game keeps the results independent of
+    # which worker happened to play it
+    g = mm.Game(headless=True, seed=seed)
+    g.input_policy = POLICIES[policy](seed)
+    g.run_headless(max_frames, verbose=False)
+    return g.get_stats()
+
+
+def summarize(results, elapsed):
+    """Print a summary of a list of game stats."""
+    n = len(results)
+    print "Games: %d in %.1f seconds (%.0f games/minute)" % \
+     (n, elapsed, (n * 60.0) / max(elapsed, 0.001))
+
+    for key in ('score', 'level', 'frames', 'deaths'):
+        values = [r[key] for r in results]
+        print "%-8s mean %10.1f  min %8d  max %8d" % (key + ':', \
+         float(sum(values)) / n, min(values), max(values))
+
+    frames = sum([r['frames'] for r in results])
+    print "Simulated frames: %d (%.0f fps)" % \
+     (frames, frames / max(elapsed, 0.001))
+
+    spawned = {}
+    for r in results:
+        for name, count in r['spawned'].items():
+            spawned[name] = spawned.get(name, 0) + count
+    print "Monsters spawned:"
+    for name in sorted(spawned):
+        print "  %-10s %8d  (%.1f per game)" % \
+         (name, spawned[name], float(spawned[name]) / n)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--games", type="int", default=100,
+            help="number of games to simulate (default: %default)")
+    parser.add_option("-s", "--seed", type="int", default=1,
+            help="seed of the first game (default: %default)")
+    parser.add_option("-p", "--policy", default="random",
+            choices=sorted(POLICIES.keys()),
+            help="input policy: %s (default: %%default)" % \
+            ", ".join(sorted(POLICIES.keys())))
+    parser.add_option("-f", "--frames", type="int", default=0,
+            help="stop each game after N frames (default: game over)")
+    parser.add_option("-j", "--jobs", type="int",
+            default=multiprocessing.cpu_count(),
+            help="number of worker processes (default: %default)")
+    parser.add_option("--json", metavar="FILE",
+            help="write the stats of every game to FILE")
+    (options, args) = parser.parse_args()
+
+    tasks = [(options.seed + i, options.policy, options.frames) \
+     for i in xrange(options.games)]
+
+    start = time.time()
+    pool = multiprocessing.Pool(options.jobs)
+    results = pool.map(play, tasks, max(1, len(tasks) / (options.jobs * 4)))
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+
+    summarize(results, elapsed)
+
+    if options.json:
+        f = open(options.json, 'w')
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+
+
+if __name__ == '__main__':
+    # game data is loaded relative to the game directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    main()
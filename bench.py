@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# vim:set sts=4 et sw=4 ts=4 ci ai:
+"""
+bench.py -- benchmarks for Monsters and Mushrooms.
+
+Micro benchmarks time single hot spots headless. Scenarios build a
+game state -- a full Millipede, Millipedes of up to 400 segments,
+the eight spider attack, a monster swarm, a dense mushroom field, the
+ninth Millipede -- and time the update and the draw of every frame
+separately. The same seed always plays out the same frames, so
+results saved with --json can be compared across commits with
+--compare.
+
+usage: bench.py [-n REPEAT] [-f FRAMES] [-d DENSITY] [-s SEED]
+                [--no-draw] [--json FILE] [--compare FILE] [BENCHMARK...]
+"""
+
+import array
+import json
+import optparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+import game as mm
+
+
+def timed(fn, repeat, setup=None):
+    """Return the best and mean seconds per call of fn over repeat
+    calls, setup is called untimed before each call."""
+    times = []
+    for i in xrange(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return (min(times), sum(times) / len(times))
+
+
+def report(name, best, mean):
+    print "%-32s best %9.3f ms  mean %9.3f ms" % \
+     (name, best * 1000.0, mean * 1000.0)
+
+
+def percentiles(times):
+    """Return a dict of statistics in milliseconds of a list of
+    seconds."""
+    if not times:
+        return {}
+    times = sorted(times)
+    n = len(times)
+    def at(p):
+        return times[int(round(p * (n - 1)))] * 1000.0
+    return {
+        'mean' : sum(times) * 1000.0 / n,
+        'min' : times[0] * 1000.0,
+        'p50' : at(0.50),
+        'p90' : at(0.90),
+        'p99' : at(0.99),
+        'max' : times[-1] * 1000.0,
+    }
+
+
+def check_counts(field):
+    """Check the counts and masks of field against a rescan, untimed."""
+    check = mm.MushroomField.CHECK_COUNTS
+    mm.MushroomField.CHECK_COUNTS = True
+    field.check_player_area_mushrooms()
+    mm.MushroomField.CHECK_COUNTS = check
+
+
+def bench_birth_and_death(options):
+    """Mushroom Birth and Death: per cell loop vs bitboards."""
+    g = mm.Game(headless=True, seed=options.seed)
+    g.new_game()
+    field = g.mushroom_field
+
+    # a dense field makes for plenty of births and deaths
+    rand = random.Random(options.seed)
+    field.reset()
+    for fy in xrange(0, mm.MushroomField.FIELD_HEIGHT - 1):
+        for fx in xrange(0, mm.MushroomField.FIELD_WIDTH):
+            if rand.random() < options.density:
+                field.add_mushroom(fx, fy)
+
+    # the cells, and the counts and masks the field keeps of them
+    saved = [(a, array.array(a.typecode, a)) for a in \
+     (field.hp, field.poisoned, field.flower, field.ttl, field.ddt,
+     field.row_live, field.row_occupied, field.row_poisoned)]
+    total = field.total_player_area_mushrooms
+    wilting = list(field.wilting)
+
+    def restore():
+        for a, copy in saved:
+            a[:] = copy
+        field.total_player_area_mushrooms = total
+        field.wilting = list(wilting)
+        check_counts(field)
+
+    print "Birth and Death, %dx%d field, %d mushrooms:" % \
+     (mm.MushroomField.FIELD_WIDTH, mm.MushroomField.FIELD_HEIGHT,
+     sum([1 for hp in field.hp if hp > 0]))
+    scan = timed(field.birth_and_death_scan, options.repeat, restore)
+    report("  birth_and_death_scan", *scan)
+    step = timed(field.birth_and_death, options.repeat, restore)
+    report("  birth_and_death", *step)
+    print "  speedup %.1fx" % (scan[0] / max(step[0], 1e-9))
+    return {
+        'birth_and_death_scan' : {'best' : scan[0] * 1000.0,
+         'mean' : scan[1] * 1000.0},
+        'birth_and_death' : {'best' : step[0] * 1000.0,
+         'mean' : step[1] * 1000.0},
+    }
+
+
+def bench_life_step(options):
+    """life_step on fields much larger than the arena."""
+    rand = random.Random(options.seed)
+    print "life_step:"
+    results = {}
+    for size in (30, 100, 300, 1000):
+        board = 0
+        for i in xrange(0, size * size):
+            if rand.random() < options.density:
+                board |= 1 << i
+        best, mean = timed(lambda: mm.life_step(board, size, size),
+         options.repeat)
+        report("  %dx%d" % (size, size), best, mean)
+        results["%dx%d" % (size, size)] = {'best' : best * 1000.0,
+         'mean' : mean * 1000.0}
+    return results
+
+
+#####################################################################
+# scenarios -- each builds a game state on a new game and returns a
+# function called before every frame, or None
+
+
+class NoWait:
+    """Frame rate clock which does not wait, draws are timed flat out."""
+
+    def tick(self, frame_rate=0):
+        return 0
+
+
+def fill_field(g, density, seed):
+    """Put mushrooms on density of the cells above the player area."""
+    rand = random.Random(seed)
+    field = g.mushroom_field
+    field.reset()
+    for fy in xrange(0, mm.MushroomField.FIELD_PLAYER_Y_POS /
+     mm.MushroomField.MUSHROOM_HEIGHT):
+        for fx in xrange(0, mm.MushroomField.FIELD_WIDTH):
+            if rand.random() < density:
+                field.add_mushroom(fx, fy)
+
+
+def clear_millipedes(g):
+    """Remove every Millipede."""
+    g.millipedes = []
+    g.segments.clear()
+    g.millipede_snd.stop()
+
+
+def scenario_millipede(g, options):
+    """A full 12 segment Millipede crawling through the field."""
+    clear_millipedes(g)
+    g.millipedes.append(mm.Millipede(g, mm.Millipede.MAX_SEGMENTS))
+
+
+def scenario_long_millipedes(g, options):
+    """A 12, a 100 and a 400 segment Millipede, far longer than any
+    level makes, entering the arena one after the other."""
+    clear_millipedes(g)
+    for (fx, n) in ((5, 12), (15, 100), (25, 400)):
+        g.millipedes.append(mm.Millipede(g, n,
+         (fx * mm.MushroomField.MUSHROOM_WIDTH, mm.Millipede.start_y)))
+
+
+def scenario_spiders(g, options):
+    """The eight spider attack at 100,000 points."""
+    g.prev_score = 99990
+    g.score = 100000
+    g.one_up_and_eight_spiders()
+    # the millipede would end the level before the spiders are done
+    clear_millipedes(g)
+    g.repeat_level = True
+
+
+def scenario_swarm(g, options):
+    """The bee, dragonfly and mosquito swarm stage with all of its 100
+    monsters on screen at once."""
+    clear_millipedes(g)
+    g.swarm_init(mm.Game.BEEDRAGONFLYMOSQUITO_SWARM)
+    def each(g):
+        # the stage never ends, monsters leaving are replaced at once
+        g.swarm_count = 100
+        while len(g.monsters) < 100:
+            i = g.swarm_next_monster
+            g.spawn_monster(g.swarm_monster[i], g.swarm_monster_lst[i])
+            g.swarm_next_monster = (i + 1) % len(g.swarm_monster)
+    return each
+
+
+def scenario_dense_field(g, options):
+    """Mushroom Birth and Death running on a dense field."""
+    fill_field(g, options.density, options.seed)
+    def each(g):
+        if not g.birthanddeathfn:
+            g.birth_and_death_init()
+    return each
+
+
+def scenario_ninth_millipede(g, options):
+    """The ninth Millipede stage scrolling the field down."""
+    fill_field(g, options.density, options.seed)
+    def each(g):
+        if not g.the_ninth_millipede:
+            g.the_ninth_millipede = True
+            g.scroll_mushroomfield_delay = g.get_ticks()
+    return each
+
+
+SCENARIOS = [
+    ('millipede', scenario_millipede),
+    ('long_millipedes', scenario_long_millipedes),
+    ('spiders', scenario_spiders),
+    ('swarm', scenario_swarm),
+    ('dense_field', scenario_dense_field),
+    ('ninth_millipede', scenario_ninth_millipede),
+]
+
+
+def bench_scenario(name, setup, options):
+    """Play options.frames frames of a scenario timing the update and
+    the draw of every frame."""
+    g = mm.Game(headless=not options.draw, game_clock=mm.VirtualClock(),
+     seed=options.seed)
+    mm.game = g
+    g.new_game()
+    each = setup(g, options)
+    # nobody is playing, the player would only get in the way
+    g.players.empty()
+    g.playerMissiles.empty()
+    g.playerMissile.active = False
+    g.clock = NoWait()
+    # decoding sounds in the background would skew the first frames
+    g.sounds.wait()
+
+    update = []
+    draw = []
+    peak = 0
+    for frame in xrange(options.frames):
+        if each:
+            each(g)
+        start = time.time()
+        g.main_update()
+        update.append(time.time() - start)
+        if options.draw:
+            start = time.time()
+            g.main_draw()
+            draw.append(time.time() - start)
+        g.game_clock.tick()
+        peak = max(peak, len(g.monsters) + len(g.segments.owner) -
+         len(g.segments.free_ids))
+    g.millipede_snd.stop()
+
+    result = {
+        'frames' : options.frames,
+        'peak_actors' : peak,
+        'update' : percentiles(update),
+    }
+    print "%s, %d frames, up to %d monsters and segments:" % \
+     (name, options.frames, peak)
+    report_percentiles("  update", result['update'])
+    if options.draw:
+        result['draw'] = percentiles(draw)
+        report_percentiles("  draw", result['draw'])
+    return result
+
+
+def report_percentiles(name, stats):
+    print "%-10s mean %7.3f  p50 %7.3f  p90 %7.3f  p99 %7.3f  max %7.3f ms" \
+     % (name, stats['mean'], stats['p50'], stats['p90'], stats['p99'],
+     stats['max'])
+
+
+#####################################################################
+
+
+def compare(results, path):
+    """Print how results changed against the results saved in path."""
+    f = open(path)
+    old = json.load(f)
+    f.close()
+    print "Compared to %s (%s):" % (path, old.get('commit'))
+    for name in sorted(results['benchmarks']):
+        if name not in old['benchmarks']:
+            continue
+        new_bench = results['benchmarks'][name]
+        old_bench = old['benchmarks'][name]
+        for key in sorted(new_bench):
+            new_stats = new_bench[key]
+            old_stats = old_bench.get(key)
+            if not isinstance(new_stats, dict) or \
+             not isinstance(old_stats, dict):
+                continue
+            if 'p50' in new_stats:
+                stat = 'p50'
+            else:
+                stat = 'best'
+            if old_stats.get(stat):
+                print "  %-36s %s %9.3f -> %9.3f ms  %+6.1f%%" % \
+                 (name + ' ' + key, stat, old_stats[stat], new_stats[stat],
+                 (new_stats[stat] / old_stats[stat] - 1.0) * 100.0)
+
+
+def git_commit():
+    """Return the commit of the working tree, or None."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+         'HEAD'], stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+MICRO = [
+    ('birth_and_death', bench_birth_and_death),
+    ('life_step', bench_life_step),
+]
+
+
+def main():
+    names = [name for (name, fn) in MICRO + SCENARIOS]
+    parser = optparse.OptionParser(usage="%prog [options] [BENCHMARK...]",
+            epilog="benchmarks: %s (default: all)" % ", ".join(names))
+    parser.add_option("-n", "--repeat", type="int", default=50,
+            help="calls per micro benchmark (default: %default)")
+    parser.add_option("-f", "--frames", type="int", default=2000,
+            help="frames per scenario (default: %default)")
+    parser.add_option("-d", "--density", type="float", default=0.35,
+            help="fraction of cells holding a mushroom "
+            "(default: %default)")
+    parser.add_option("-s", "--seed", type="int", default=1,
+            help="random seed (default: %default)")
+    parser.add_option("--no-draw", action="store_false", dest="draw",
+            default=True, help="time the scenario updates only")
+    parser.add_option("--json", metavar="FILE",
+            help="save the results to FILE")
+    parser.add_option("--compare", metavar="FILE",
+            help="compare the results with those saved in FILE")
+    (options, args) = parser.parse_args()
+
+    for name in args:
+        if name not in names:
+            parser.error("unknown benchmark: %s" % name)
+    if not args:
+        args = names
+
+    if options.draw:
+        # draws go to an off-screen display unless told otherwise
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+    results = {
+        'commit' : git_commit(),
+        'python' : sys.version.split()[0],
+        'pygame' : mm.pygame.version.ver,
+        'options' : {'repeat' : options.repeat, 'frames' : options.frames,
+         'density' : options.density, 'seed' : options.seed,
+         'draw' : options.draw},
+        'benchmarks' : {},
+    }
+    for (name, fn) in MICRO:
+        if name in args:
+            results['benchmarks'][name] = fn(options)
+    for (name, setup) in SCENARIOS:
+        if name in args:
+            results['benchmarks'][name] = \
+             bench_scenario(name, setup, options)
+
+    if options.compare:
+        compare(results, options.compare)
+    if options.json:
+        f = open(options.json, 'w')
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+
+
+if __name__ == '__main__':
+    # game data is loaded relative to the game directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    main()
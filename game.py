@@ -22,10 +22,21 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301
 USA
 """
 
+import array
+import collections
+import copy
+import heapq
+import itertools
+import json
+import optparse
 import os
 import pygame
+import Queue
 import random
+import struct
 import sys
+import threading
+import time
 
 """
 millipede dimensions -- from atari acrcade version
@@ -96,46 +107,119 @@ class Game:
 
     RANDOM_EVENT_FREQ = 50
  
-    def __init__(self):
+    def __init__(self, headless=False, game_clock=None, seed=None,
+     stream_sounds=False):
+        """headless - run the simulation only: no display, no mixer,
+        and no input events.
+        game_clock - source of game time, defaults to a VirtualClock
+        when headless and to a WallClock otherwise.
+        seed - seed for every new game, None picks a fresh random seed
+        each time a game starts.
+        stream_sounds - stream the long looping sounds from their files
+        instead of decoding them into memory.
+        """
         max_columns = Game.SCREEN_W / MushroomField.MUSHROOM_WIDTH
 
-        pygame.init()
+        self.headless = headless
+
+        # every game owns its random number generator, all actors
+        # draw from it through named streams -- see random_stream()
+        self.fixed_seed = seed
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.rng_counts = {}
+        self.random_streams = {}
+        self.rand = self.random_stream('game')
+
+        # input_policy -- when set supplies the keys vector every frame
+        # recorder -- when set records the keys vector every frame
+        self.input_policy = None
+        self.recorder = None
+
+        # dirty_rects -- when set only the changed parts of the screen
+        # are pushed to the display instead of flipping it every frame
+        self.dirty_rects = False
+
+        # profiler -- times the phases of every frame, see FrameProfiler
+        if self.headless:
+            self.profiler = NoProfiler()
+        else:
+            self.profiler = FrameProfiler()
+
+        if game_clock == None:
+            if self.headless:
+                game_clock = VirtualClock()
+            else:
+                game_clock = WallClock()
+        self.game_clock = game_clock
+
+        if self.headless:
+            # the font is still needed to pre-render the popup scores
+            pygame.font.init()
+        else:
+            pygame.init()
         if not pygame.font: print "Warning: fonts disabled."
         mixer_init = pygame.mixer.get_init()
-        if not mixer_init: print "Warning: mixer disabled."
+        if not mixer_init and not self.headless:
+            print "Warning: mixer disabled."
         if mixer_init:
             print "Mixer available channels: ", \
             pygame.mixer.get_num_channels()
 
-        pygame.display.set_caption('Monsters and Mushrooms')
-
         system_font = pygame.font.get_default_font()
         self.font = pygame.font.SysFont( None, 24 ) 
+        self.text = TextCache(self.font)
         
-        # init joystick 0
-        num_joystick = pygame.joystick.get_count()
-        if num_joystick > 0:
-            joy = pygame.joystick.Joystick( num_joystick - 1 )
-            if not joy.init():
-                print "Warning: could not initialize joystick(s)"
-        
+        # the score bar is composed off-screen when its values change
+        self.hud = pygame.Surface([Game.SCREEN_W, Game.SCORE_H-1])
+        self.hud_values = None
+
         # allocate backbuffer
         size = Game.SCREEN_W, Game.SCREEN_H
-        #self.screen = pygame.display.set_mode(size,pygame.FULLSCREEN)
-        self.screen = pygame.display.set_mode(size)
         self.background = pygame.Surface(size)
         self.background.fill([0,0,0])
-        self.screen.blit(self.background, [0,0])
+
+        # the arena background has the player area boundaries
+        self.arena_background = self.background.copy()
+        pygame.draw.line(self.arena_background,
+                (0,0,128),
+                (0,Game.ARENA_H-Game.PLAYER_H),
+                (Game.ARENA_W,Game.ARENA_H-Game.PLAYER_H))
+        pygame.draw.line(self.arena_background,
+                (0,0,128),
+                (0,Game.ARENA_H),
+                (Game.ARENA_W,Game.ARENA_H))
+
+        if not self.headless:
+            pygame.display.set_caption('Monsters and Mushrooms')
+
+            # init joystick 0
+            num_joystick = pygame.joystick.get_count()
+            if num_joystick > 0:
+                joy = pygame.joystick.Joystick( num_joystick - 1 )
+                if not joy.init():
+                    print "Warning: could not initialize joystick(s)"
+
+            #self.screen = pygame.display.set_mode(size,pygame.FULLSCREEN)
+            self.screen = pygame.display.set_mode(size)
+            self.screen.blit(self.background, [0,0])
         
-        # initialize sounds
-        self.millipede_snd = load_sound("sounds/millipede.ogg")
-        self.player_missile_snd = load_sound("sounds/shot1.ogg")
-        self.player_hit_snd = load_sound("sounds/exp1.ogg")
-        self.ddt_snd = load_sound("sounds/exp2.ogg")
-        self.bee_snd = load_sound("sounds/bee1.ogg")
-        self.mosquito_snd = load_sound("sounds/fly.ogg")
-        self.spider_snd = load_sound("sounds/spider.ogg")
-        self.dragonfly_snd = load_sound("sounds/bee2.ogg")
+        # initialize sounds -- they are decoded in the background while
+        # the main menu runs, see SoundLoader
+        self.sounds = shared_sound_loader()
+        self.millipede_snd = self.sounds.load("sounds/millipede.ogg",
+         stream_sounds)
+        self.player_missile_snd = self.sounds.load("sounds/shot1.ogg")
+        self.player_hit_snd = self.sounds.load("sounds/exp1.ogg")
+        self.ddt_snd = self.sounds.load("sounds/exp2.ogg")
+        self.bee_snd = self.sounds.load("sounds/bee1.ogg")
+        self.mosquito_snd = self.sounds.load("sounds/fly.ogg")
+        self.spider_snd = self.sounds.load("sounds/spider.ogg",
+         stream_sounds)
+        self.dragonfly_snd = self.sounds.load("sounds/bee2.ogg")
+
+        # every image comes out of the atlas from here on
+        load_atlas()
 
         # load main game static screens
         self.title_img = load_image("images/title.png")
@@ -170,6 +254,12 @@ class Game:
         self.cur_tick = 0
         self.prev_tick = 0
 
+        # dirty rect bookkeeping -- see begin_frame()
+        self.drawn_screen = None
+        self.drawn_rects = []
+        self.update_rects = []
+        self.score_drawn = None
+
         self.spawn_queue = {
             'bees' : 0,
             'beetles' : 0,
@@ -195,9 +285,9 @@ class Game:
         self.birthanddeathfn = None
         
         self.player = Player(self)
-        self.players = pygame.sprite.Group()
+        self.players = pygame.sprite.RenderUpdates()
         self.playerMissile = PlayerMissile(self)
-        self.playerMissiles = pygame.sprite.Group()
+        self.playerMissiles = pygame.sprite.RenderUpdates()
         self.playerMissiles.add( self.playerMissile )
 
         self.popups = PopUps(self)
@@ -205,6 +295,7 @@ class Game:
 
         self.mushroom_field = MushroomField(self)
 
+        self.segments = SegmentPool()
         self.millipedes = []
 
         self.spiders = pygame.sprite.Group()
@@ -214,10 +305,14 @@ class Game:
         self.earwigs = pygame.sprite.Group()
         self.dragonflies = pygame.sprite.Group()
         self.inchworms = pygame.sprite.Group()
-        self.monsters = pygame.sprite.Group()
-        self.ddts = pygame.sprite.Group()
+        # ordered groups keep update and collision order, and with it
+        # the order of random draws, identical from run to run
+        self.monsters = GridGroup()
+        self.ddts = GridGroup()
 
-        self.damaged_mushrooms = []
+        self.damaged_mushrooms = CellSet(MushroomField.MAX_MUSHROOMS)
+
+        self.stats = { 'frames' : 0, 'deaths' : 0, 'spawned' : {} }
         
         self.random_event_delay = 0
         self.cur_level_random_event_delay = Game.START_RANDOM_EVENT_DELAY
@@ -261,6 +356,11 @@ class Game:
     def game_reset(self):
         """Reset game variables."""
 
+        self.seed_random()
+
+        # per game statistics -- see get_stats()
+        self.stats = { 'frames' : 0, 'deaths' : 0, 'spawned' : {} }
+
         self.keys = [False, False, False, False, False]
         self.score = 0
         self.prev_score = 0
@@ -292,7 +392,7 @@ class Game:
         self.cur_level_random_event_delay = Game.START_RANDOM_EVENT_DELAY
 
         # keep track of damaged mushrooms
-        self.damaged_mushrooms = []
+        self.damaged_mushrooms.clear()
         
         #player info
         self.score = 0
@@ -343,6 +443,7 @@ class Game:
         self.players.empty()
         self.playerMissiles.empty()
         self.millipedes = []
+        self.segments.clear()
         for m in self.monsters:
             m.kill()
         for d in self.ddts:
@@ -362,9 +463,14 @@ class Game:
         self.playerMissiles.add( self.playerMissile )
 
 
+    def clock_ticks(self):
+        """Return the raw clock time in milliseconds."""
+        return self.game_clock.get_ticks()
+
+
     def get_ticks(self):
         """Return game clock ticks."""
-        t = pygame.time.get_ticks()
+        t = self.clock_ticks()
         dt = t - self.prev_tick
         self.prev_tick = t
         self.cur_tick += dt
@@ -401,21 +507,102 @@ class Game:
 
     def reset_ticks(self):
         """Reset game tick counter. Must be called after a Pause."""
-        self.prev_tick = pygame.time.get_ticks()
+        self.prev_tick = self.clock_ticks()
+
+
+    def quit(self):
+        """Exit the game."""
+        self.stop_recording()
+        self.profiler.save()
+        sys.exit()
 
 
     def run(self):
         """Main game loop."""
         while True:
+            self.profiler.start()
+            self.actionfn()
+            self.game_clock.tick()
+            self.profiler.stop()
+
+
+    def run_headless(self, max_frames=0, verbose=True):
+        """Simulate a single game as fast as possible.
+
+        max_frames - stop after this many frames, 0 plays until game over
+        verbose - print the simulated frames per second and random draws
+
+        Returns a tuple (frames, seconds).
+        """
+        self.new_game()
+        frames = 0
+        start = time.time()
+        while self.actionfn != self.game_over:
+            self.profiler.start()
             self.actionfn()
+            self.game_clock.tick()
+            self.profiler.stop()
+            frames += 1
+            if max_frames and frames >= max_frames:
+                break
+        self.stop_recording()
+        self.profiler.save()
+        self.stats['frames'] = frames
+        elapsed = time.time() - start
+        if not verbose:
+            return (frames, elapsed)
+        if elapsed > 0:
+            fps = frames / elapsed
+        else:
+            fps = 0
+        print "Simulated %d frames in %.2f seconds: %.1f fps (seed %d)" % \
+         (frames, elapsed, fps, self.seed)
+        draws = ["%s %d" % (name, self.rng_counts[name]) \
+         for name in sorted(self.rng_counts)]
+        print "Random draws: %s" % ", ".join(draws)
+        return (frames, elapsed)
+
+
+    def new_game(self):
+        """Start a new game at level one."""
+        self.game_reset()
+        self.level_reset()
+        self.level_init()
+        self.actionfn = self.main
+        self.prev_actionfn = None
+        self.game_start()
+        self.reset_ticks()
+        if self.recorder:
+            self.recorder.start(self.seed)
+
+
+    def stop_recording(self):
+        """Write out the input recording of the current game."""
+        if self.recorder:
+            self.recorder.stop()
 
 
     def main(self):
         """Game run."""
+        if not self.headless:
+            self.main_events()
+            self.profiler.lap('events')
+        if self.input_policy:
+            self.keys = self.input_policy.get_keys(self)
+        if self.recorder:
+            self.recorder.record(self.keys)
+        self.profiler.lap('input')
+        self.main_update()
+        if not self.headless:
+            self.main_draw()
+
+
+    def main_events(self):
+        """Poll keyboard and joystick events."""
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                sys.exit()
+                self.quit()
             elif event.type == pygame.JOYAXISMOTION:
                 #print "move pad: ", event.joy, event.axis, event.value
                 if event.axis == 1:
@@ -455,12 +642,12 @@ class Game:
                  (event.key == pygame.K_LCTRL):
                     self.keys[4] = True
                 elif event.key == pygame.K_ESCAPE:
-                    sys.exit()
+                    self.quit()
                 elif event.key == pygame.K_p:
                     self.prev_actionfn = self.actionfn
                     self.menu_delay = self.get_ticks()
                     self.actionfn = self.pause
-                    pygame.mixer.pause()
+                    self.sounds.pause()
                 elif event.key == pygame.K_m:
                     mushroom_field_print()
                 elif event.key == pygame.K_g:
@@ -469,6 +656,12 @@ class Game:
                     gy = y / MushroomField.MUSHROOM_HEIGHT
                     print "Player position: (%d, %d) : (%d, %d)" % \
                      (x, y, gx, gy)
+                elif event.key == pygame.K_t:
+                    self.profiler.show = not self.profiler.show
+                elif self.recorder:
+                    # the debug keys below change the game in ways
+                    # that an input recording can not reproduce
+                    pass
                 elif event.key == pygame.K_0:
                     self.swarm_init(Game.BEE_SWARM)
                 elif event.key == pygame.K_1:
@@ -498,12 +691,19 @@ class Game:
                  (event.key == pygame.K_LCTRL):
                     self.keys[4] = False
 
+
+    def main_update(self):
+        """Update all actors for a single frame."""
+
+        prof = self.profiler
+
         # save current score -- used to check for player 1-UP
         self.prev_score = self.score
 
         # swarm stage?
         if self.swarmfn:
             self.swarmfn()
+            prof.lap('swarm')
 
         # the 9th Millipede?
         if self.the_ninth_millipede:
@@ -512,35 +712,45 @@ class Game:
             if dt > Game.THE_NINTH_MILLIPEDE_DELAY:
                 self.scroll_mushroomfield_delay = self.get_ticks()
                 self.mushroom_field.row_down()
+                prof.lap('row_down')
  
         # do not allow monsters to spawn before a level up
         # the millipede is king!
         if not self.level_up_delay:
             self.random_events()
+            prof.lap('random_events')
             self.spawn_monsters()
+            prof.lap('spawn_monsters')
 
         # do we need to planet some mushrooms?
         if self.birthanddeathfn:
             self.birthanddeathfn()
+            prof.lap('birth_and_death')
+
+        self.mushroom_field.wilt_flowers()
+        prof.lap('wilt_flowers')
 
         # update actors - move player, update missile, move the milliepede
         # ddts, ddt collisions, millipedes, monsters, player, player-missle
 
         self.ddts.update()
+        prof.lap('ddts')
 
         # check for ddt collisions
         self.ddt_collisions = True
         for d in self.ddts:
             if d.active:
                 # check for millipede collisions
-                for m in self.millipedes:
-                    m.collision(d.rect)
+                if self.segments.hit_any(d.rect):
+                    for m in self.millipedes:
+                        m.collision(d.rect)
 
                 # check for collisions against all other monsters
-                m_lst = pygame.sprite.spritecollide( d, self.monsters, False)
+                m_lst = self.monsters.collide(d.rect)
                 for m in m_lst:
                     m.collision()
         self.ddt_collisions = False
+        prof.lap('ddt_collisions')
 
         # check for time slow down
         if self.slow_down_time:
@@ -549,20 +759,27 @@ class Game:
                 self.slow_down_time = False
 
             if (cur_time - self.time_delay) > Game.SLOW_DOWN_TIME_TTL_DT:
-                for m in self.millipedes:
-                    m.move()
+                self.move_millipedes()
+                prof.lap('millipedes')
                 self.monsters.update()
+                self.monsters.refile()
+                prof.lap('monsters')
                 self.time_delay = cur_time
         else:
-                for m in self.millipedes:
-                    m.move()
+                self.move_millipedes()
+                prof.lap('millipedes')
                 self.monsters.update()
+                self.monsters.refile()
+                prof.lap('monsters')
 
         self.particles.update()
+        prof.lap('particles')
         self.players.update(self.keys, self.playerMissile)
+        prof.lap('player')
 
         if self.playerMissile.active:
             self.playerMissile.move()
+            prof.lap('missile')
 
 
         """
@@ -575,6 +792,7 @@ class Game:
         if self.player_dead:
             # need to add a delay before this method is called....
             self.player_lives -= 1
+            self.stats['deaths'] += 1
             self.actionfn = self.player_die_init 
             # check to see if we need to repeat the level
             self.millipede_snd.stop()
@@ -605,44 +823,110 @@ class Game:
 
         # check for 1-up
         self.one_up_and_eight_spiders()
+        prof.lap('rules')
+
+
+    def begin_frame(self, screen_name):
+        """Start drawing a frame of screen screen_name.
+
+        Returns True when the whole screen has to be drawn: every
+        frame when flipping, only the first frame of a screen when
+        using dirty rects. Otherwise erases the actors drawn last frame.
+        """
+        if not self.dirty_rects:
+            self.drawn_rects = []
+            return True
+        if self.drawn_screen != screen_name:
+            self.drawn_screen = screen_name
+            self.drawn_rects = []
+            self.update_rects = [self.screen.get_rect()]
+            self.score_drawn = None
+            return True
+        for r in self.drawn_rects:
+            self.restore_arena(r)
+        # the erased rects need pushing as well
+        self.update_rects = self.drawn_rects
+        self.drawn_rects = []
+        return False
+
+
+    def end_frame(self):
+        """Show the frame and wait for the next one."""
+        if self.dirty_rects:
+            pygame.display.update(self.update_rects + self.drawn_rects)
+        else:
+            pygame.display.flip()
+        self.profiler.lap('flip')
+        self.clock.tick(Game.FRAME_RATE)
+        self.profiler.lap('wait')
+
+
+    def restore_arena(self, rect):
+        """Redraw the arena background and mushrooms inside rect."""
+        self.screen.blit(self.arena_background, rect, rect)
+        self.mushroom_field.draw_area(self.screen, rect)
+        if rect.bottom > Game.ARENA_H:
+            self.score_drawn = None
+
 
+    def main_draw(self, actors=True):
+        """Draw a frame and wait for the next one.
+
+        actors - False draws only the mushroom field, DDTs and score.
+        """
+
+        prof = self.profiler
 
         # start drawing a frame
-        self.screen.blit(self.background, [0,0])
+        if self.begin_frame('arena'):
+            self.screen.blit(self.arena_background, [0,0])
+            self.mushroom_field.draw(self.screen)
+        else:
+            for r in self.mushroom_field.update_layer():
+                self.restore_arena(r)
+                self.update_rects.append(r)
+        prof.lap('draw_field')
 
-        # player area boundaries
-        pygame.draw.line(self.screen,
-                (0,0,128),
-                (0,Game.ARENA_H-Game.PLAYER_H),
-                (Game.ARENA_W,Game.ARENA_H-Game.PLAYER_H))
-        pygame.draw.line(self.screen,
-                (0,0,128),
-                (0,Game.ARENA_H),
-                (Game.ARENA_W,Game.ARENA_H))
+        # draw actors, remembering where for the next frame
+        drawn = self.drawn_rects
 
-        # draw actors
-        self.players.draw(self.screen)
+        if actors:
+            drawn.extend(self.players.draw(self.screen))
 
-        if self.playerMissile.active:
-            self.playerMissiles.draw(self.screen)
+            if self.playerMissile.active:
+                drawn.extend(self.playerMissiles.draw(self.screen))
+            prof.lap('draw_player')
 
-        self.mushroom_field.draw(self.screen)
-        
-        self.ddts.draw(self.screen)
-        
-        for m in self.millipedes:
-            m.draw(self.screen)
+        drawn.extend(self.ddts.draw(self.screen))
+        prof.lap('draw_ddts')
+
+        if actors:
+            for m in self.millipedes:
+                drawn.extend(m.draw(self.screen))
+            prof.lap('draw_millipedes')
             
-        self.monsters.draw(self.screen)
+            drawn.extend(self.monsters.draw(self.screen))
+            prof.lap('draw_monsters')
         
-        self.particles.draw(self.screen)
+            drawn.extend(self.particles.draw(self.screen))
+            prof.lap('draw_particles')
         
-        self.popups.draw(self.screen)
+            drawn.extend(self.popups.draw(self.screen))
+            prof.lap('draw_popups')
 
+        # actors hanging past the arena were drawn over the score bar
+        for r in drawn:
+            if r.bottom > Game.ARENA_H:
+                self.score_drawn = None
+                break
         self.draw_score()
+        prof.lap('draw_score')
 
-        pygame.display.flip()
-        self.clock.tick(Game.FRAME_RATE)
+        if prof.show:
+            drawn.append(prof.draw(self.screen))
+            prof.lap('draw_profile')
+
+        self.end_frame()
 
 
     def main_menu_init(self):
@@ -658,7 +942,7 @@ class Game:
         start = False
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                sys.exit()
+                self.quit()
             elif event.type == pygame.JOYBUTTONDOWN:
                 if event.joy == 0 and event.button == 0:
                     start = True
@@ -667,32 +951,33 @@ class Game:
                  (event.key == pygame.K_LCTRL):
                     start = True
                 elif event.key == pygame.K_ESCAPE:
-                    sys.exit()
+                    self.quit()
 
-        self.screen.blit(self.background, [0,0])
-        self.screen.blit(self.title_img, [0,50])
+        full = self.begin_frame('main_menu')
+        if full:
+            self.screen.blit(self.background, [0,0])
+            self.screen.blit(self.title_img, [0,50])
 
+        blink = False
         dt = self.get_ticks() - self.start_img_delay
         if dt > 275:
             self.start_img_delay = self.get_ticks()
             self.start_img_idx += 1
             if self.start_img_idx == len(self.start_img):
                 self.start_img_idx = 0
+            blink = True
 
-        self.screen.blit(self.start_img[self.start_img_idx],\
-        [Game.SCREEN_W/4,200])
+        if full or blink:
+            img = self.start_img[self.start_img_idx]
+            r = img.get_rect(topleft=[Game.SCREEN_W/4,200])
+            self.screen.blit(self.background, r, r)
+            self.screen.blit(img, r)
+            self.update_rects.append(r)
 
-        pygame.display.flip()
-        self.clock.tick(Game.FRAME_RATE)
+        self.end_frame()
 
         if start:
-            self.game_reset()
-            self.level_reset()
-            self.level_init()
-            self.actionfn = self.main
-            self.prev_actionfn = None
-            self.game_start()
-            self.reset_ticks()
+            self.new_game()
 
 
     def pause(self):
@@ -701,23 +986,23 @@ class Game:
         for event in pygame.event.get():
             
             if event.type == pygame.QUIT:
-                sys.exit()
+                self.quit()
             
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_p:
                     self.actionfn = self.prev_actionfn
                     self.prev_actionfn = None
                     self.reset_ticks()
-                    pygame.mixer.unpause()
+                    self.sounds.unpause()
                 elif event.key == pygame.K_ESCAPE:
-                    sys.exit()
+                    self.quit()
         
-        self.screen.blit(self.background, [0,0])
-        #text = self.font.render("Paused", 1, (255,255,255))
-        self.screen.blit(self.paused_img, [0,Game.SCREEN_H/3])
+        if self.begin_frame('pause'):
+            self.screen.blit(self.background, [0,0])
+            #text = self.font.render("Paused", 1, (255,255,255))
+            self.screen.blit(self.paused_img, [0,Game.SCREEN_H/3])
 
-        pygame.display.flip()
-        self.clock.tick(Game.FRAME_RATE)
+        self.end_frame()
 
 
     def game_over(self):
@@ -727,7 +1012,7 @@ class Game:
         for event in pygame.event.get():
             
             if event.type == pygame.QUIT:
-                sys.exit()
+                self.quit()
             elif event.type == pygame.JOYBUTTONDOWN:
                 if event.joy == 0 and event.button == 0:
                     quit = True
@@ -737,13 +1022,13 @@ class Game:
                  (event.key == pygame.K_q):
                     quit = True
                 elif event.key == pygame.K_ESCAPE:
-                    sys.exit()
+                    self.quit()
 
-        self.screen.blit(self.background, [0,0])
-        self.screen.blit(self.gameover_img, [0,Game.SCREEN_H/3])
+        if self.begin_frame('game_over'):
+            self.screen.blit(self.background, [0,0])
+            self.screen.blit(self.gameover_img, [0,Game.SCREEN_H/3])
 
-        pygame.display.flip()
-        self.clock.tick(Game.FRAME_RATE)
+        self.end_frame()
         
         dt = self.get_ticks() - self.menu_delay
         if (dt > GAME_OVER_DELAY) or quit:
@@ -759,6 +1044,7 @@ class Game:
         self.swarm_level += 1
         #self.spawn_millipedes()
         self.millipedes.append(Millipede(self))
+        self.count_spawn(Millipede)
         self.millipede_snd.play(-1)
 
     def level_up(self):
@@ -769,7 +1055,8 @@ class Game:
         if self.swarm_level > 17:
             self.swarm_level = 1
 
-        print "special level: ", self.swarm_level
+        if DEBUG:
+            print "special level: ", self.swarm_level
 
         swarm_stage = None
 
@@ -818,7 +1105,7 @@ class Game:
         """Used by level generators and level restart."""
         # generate a random list of x-positions
         start_x = range(0,MushroomField.FIELD_WIDTH)
-        random.shuffle(start_x)
+        self.rand.shuffle(start_x)
         # reduce Millipede segments by one each level
         # cycle repeats at Millipede.MAX_SEGMENTS
         if self.cur_level == 0:
@@ -830,9 +1117,11 @@ class Game:
         if(body_len):
             xpos = start_x[0] * MushroomField.MUSHROOM_WIDTH
             self.millipedes.append(Millipede(self,body_len,(xpos,Millipede.start_y)))
+            self.count_spawn(Millipede)
         for i in range(segments):
             xpos = start_x[i+1] * MushroomField.MUSHROOM_WIDTH
             self.millipedes.append(Millipede(self,1,(xpos,Millipede.start_y)))
+            self.count_spawn(Millipede)
         
         self.millipede_snd.play(-1)
 
@@ -896,9 +1185,8 @@ class Game:
         if self.swarm_count > 0:
             dt = self.get_ticks() - self.swarm_launch_delay
             if dt > Game.SWARM_STAGE_SPAWN_DELAY:
-                m = self.swarm_monster[i](self)
-                m.add(self.monsters)
-                m.add(self.swarm_monster_lst[i])
+                self.spawn_monster(self.swarm_monster[i], \
+                 self.swarm_monster_lst[i])
                 self.swarm_count -= 1
                 self.swarm_launch_delay = self.get_ticks()
                 if (self.swarm_count % 10) == 0:
@@ -982,17 +1270,18 @@ class Game:
 
     def player_die(self):
         """Player death loop."""
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_p:
-                    self.prev_actionfn = self.actionfn
-                    self.menu_delay = self.get_ticks()
-                    self.actionfn = self.pause
-                    pygame.mixer.pause()
-                elif event.key == pygame.K_ESCAPE:
-                    sys.exit()
+        if not self.headless:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.quit()
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_p:
+                        self.prev_actionfn = self.actionfn
+                        self.menu_delay = self.get_ticks()
+                        self.actionfn = self.pause
+                        self.sounds.pause()
+                    elif event.key == pygame.K_ESCAPE:
+                        self.quit()
  
         """
         Restore any damaged mushrooms--one at a time--to full strength.
@@ -1003,7 +1292,7 @@ class Game:
             dt = self.get_ticks() - self.player_die_delay
             if dt > 25:
                 self.player_die_delay = 0
-        elif len(self.damaged_mushrooms):
+        elif self.damaged_mushrooms:
             index = self.damaged_mushrooms.pop()
             restore = self.mushroom_field.restore_mushroom(index)
             if restore:
@@ -1014,6 +1303,7 @@ class Game:
             if self.player_lives == 0:
                 self.menu_delay = self.get_ticks()
                 self.actionfn = self.game_over
+                self.stop_recording()
             else:
                 self.level_init()
                 if DEBUG:
@@ -1030,46 +1320,44 @@ class Game:
 
                 self.actionfn = self.main
 
-        # start drawing a frame
-        self.screen.blit(self.background, [0,0])
+        if self.headless:
+            return
 
-        # player area boundaries
-        pygame.draw.line(self.screen,
-                (0,0,128),
-                (0,Game.ARENA_H-Game.PLAYER_H),
-                (Game.ARENA_W,Game.ARENA_H-Game.PLAYER_H))
-        pygame.draw.line(self.screen,
-                (0,0,128),
-                (0,Game.ARENA_H),
-                (Game.ARENA_W,Game.ARENA_H))
+        self.main_draw(actors=False)
 
-        # draw actors
-        self.mushroom_field.draw(self.screen)
-        self.ddts.draw(self.screen)
 
-        self.draw_score()
+    def draw_score(self):
+        """draw game score to active screen buffer."""
+        values = (self.score, self.player_lives, self.cur_level)
+        if values != self.hud_values:
+            self.hud_values = values
+            self.hud.fill([0,0,0])
+            self.text.compose(self.hud, "S: %d" % self.score, [2,0])
+            self.text.compose(self.hud, "P: %d" % self.player_lives,
+                    [int(Game.SCREEN_W/1.35),0])
+            self.text.compose(self.hud, "L: %02d" % self.cur_level,
+                    [int(Game.SCREEN_W/1.12),0])
+
+        pos = [0,Game.SCREEN_H-Game.SCORE_H+1]
+        if self.dirty_rects:
+            # only redraw the score bar when it changes
+            if values == self.score_drawn:
+                return
+            self.score_drawn = values
+            self.update_rects.append(self.hud.get_rect(topleft=pos))
 
-        pygame.display.flip()
-        self.clock.tick(Game.FRAME_RATE)
+        self.screen.blit(self.hud, pos)
 
 
-    def draw_score(self):
-        """draw game score to active screen buffer."""
-        # draw text -- need to optimize this....
-        score = "S: %d" % self.score
-        text = self.font.render(score, 1, (255,255,255))
-        self.screen.blit(text, [2,Game.SCREEN_H-Game.SCORE_H+1])
-        lives = "P: %d" % self.player_lives
-        text = self.font.render(lives, 1, (255,255,255))
-        self.screen.blit(text, [Game.SCREEN_W/1.35,Game.SCREEN_H-Game.SCORE_H+1])
-
-        if self.cur_level < 10:
-            str = "L: 0%d" % self.cur_level
-        else:
-            str = "L: %d" % self.cur_level
+    def move_millipedes(self):
+        """Move every Millipede.
 
-        text = self.font.render(str, 1, (255,255,255))
-        self.screen.blit(text, [Game.SCREEN_W/1.12,Game.SCREEN_H-Game.SCORE_H+1])
+        Each Millipede decides where it is heading, then the ones
+        moving this frame crawl a step along it.
+        """
+        for m in self.millipedes:
+            if m.move():
+                m.crawl()
 
 
     def spawn_millipede_in_player_area(self):
@@ -1085,7 +1373,7 @@ class Game:
         y = Game.ARENA_H - Game.PLAYER_H + Millipede.HEIGHT
 
         # 50/50 chance to spawn left or right side
-        n = random.randint(0,9)
+        n = self.rand.randint(0,9)
         if n < 5:
             x0 = -Millipede.WIDTH
             x1 = 0
@@ -1107,6 +1395,7 @@ class Game:
             m.go_left()
         m.set_waypoint( x1, 0 )
         self.millipedes.append(m)
+        self.count_spawn(Millipede)
 
 
     def spawn_monsters(self):
@@ -1119,17 +1408,13 @@ class Game:
                 if (self.spawn_queue['bees'] % 4) == 1:
                     self.bee_snd.play()
                 self.spawn_queue['bees'] -= 1
-                m = Bee(self)
-                m.add(self.monsters)
-                m.add(self.bees)
+                self.spawn_monster(Bee, self.bees)
 
             max = self.max_table[self.p_table_idx]
             spawn = (len(self.beetles) < max[0])
             if spawn and self.spawn_queue['beetles']:
                 self.spawn_queue['beetles'] -= 1
-                m = Beetle(self)
-                m.add(self.monsters)
-                m.add(self.beetles)
+                self.spawn_monster(Beetle, self.beetles)
 
             if not self.eight_spider_attack:
                 max = self.max_table[self.p_table_idx]
@@ -1138,26 +1423,20 @@ class Game:
                     if len(self.spiders) == 0:
                         self.spider_snd.play(-1)
                     self.spawn_queue['spiders'] -= 1
-                    m = Spider(self)
-                    m.add(self.monsters)
-                    m.add(self.spiders)
+                    self.spawn_monster(Spider, self.spiders)
             else:
                 if len(self.spiders) == 0:
                     self.spider_snd.play(-1)
                 self.eight_spider_attack = False
                 for i in range(0,8):
-                    m = Spider(self)
-                    m.add(self.monsters)
-                    m.add(self.spiders)
+                    self.spawn_monster(Spider, self.spiders)
 
                 """
                 max = self.max_table[self.p_table_idx]
                 spawn = (len(self.spiders) < max[1])
                 if spawn and self.spawn_queue['spiders']:
                     self.spawn_queue['spiders'] -= 1
-                    m = Spider(self)
-                    m.add(self.monsters)
-                    m.add(self.spiders)
+                    self.spawn_monster(Spider, self.spiders)
                 """
 
 
@@ -1165,41 +1444,77 @@ class Game:
             spawn = (len(self.earwigs) < max[2])
             if spawn and self.spawn_queue['earwigs']:
                 self.spawn_queue['earwigs'] -= 1
-                m = Earwig(self)
-                m.add(self.monsters)
-                m.add(self.earwigs)
+                self.spawn_monster(Earwig, self.earwigs)
 
             max = self.max_table[self.p_table_idx]
             spawn = (len(self.inchworms) < max[3])
             if spawn and self.spawn_queue['inchworms']:
                 self.spawn_queue['inchworms'] -= 1
-                m = Inchworm(self)
-                m.add(self.monsters)
-                m.add(self.inchworms)
+                self.spawn_monster(Inchworm, self.inchworms)
  
             if self.spawn_queue['dragonflies']:
                 self.spawn_queue['dragonflies'] -= 1
-                m = Dragonfly(self)
-                m.add(self.monsters)
-                m.add(self.dragonflies)
+                self.spawn_monster(Dragonfly, self.dragonflies)
             
             if self.spawn_queue['mosquitos']:
                 self.spawn_queue['mosquitos'] -= 1
-                m = Mosquito(self)
-                m.add(self.monsters)
-                m.add(self.mosquitos)
+                self.spawn_monster(Mosquito, self.mosquitos)
                 self.mosquito_snd.play()
 
             self.spawn_queue['ttl'] = self.get_ticks()
 
 
+    def spawn_monster(self, monster_class, group):
+        """Create a monster and add it to the monsters and group."""
+        m = monster_class(self)
+        m.add(self.monsters)
+        m.add(group)
+        self.count_spawn(monster_class)
+        return m
+
+
+    def count_spawn(self, monster_class):
+        """Keep track of the number of monsters spawned by type."""
+        spawned = self.stats['spawned']
+        name = monster_class.__name__
+        spawned[name] = spawned.get(name, 0) + 1
+
+
+    def get_stats(self):
+        """Return a dict summarizing the current game."""
+        return {
+            'seed' : self.seed,
+            'score' : self.score,
+            'level' : self.cur_level,
+            'frames' : self.stats['frames'],
+            'deaths' : self.stats['deaths'],
+            'spawned' : dict(self.stats['spawned'])
+        }
+
+
+    def seed_random(self):
+        """Seed the random number generator for a new game."""
+        if self.fixed_seed == None:
+            self.seed = random.SystemRandom().randint(0, 0x7fffffff)
+        else:
+            self.seed = self.fixed_seed
+        self.random.seed(self.seed)
+        for name in self.rng_counts:
+            self.rng_counts[name] = 0
+
+
+    def random_stream(self, name):
+        """Return the RandomStream for subsystem name."""
+        stream = self.random_streams.get(name)
+        if stream == None:
+            stream = RandomStream(self.random, self.rng_counts, name)
+            self.random_streams[name] = stream
+        return stream
+
+
     def rng(self,start,end):
-        # spin-up the rng a technique used in angband...
-        random.randint(1,100)
-        random.randint(1,100)
-        random.randint(1,100)
-        random.randint(1,100)
-        return random.randint(1,100)
+        """Return a random integer N such that start <= N <= end."""
+        return self.rand.randint(start,end)
 
 
     def random_events(self):
@@ -1209,7 +1524,7 @@ class Game:
         # then launch bees to grow more mushroom_field...
         if self.mushroom_field.total_player_area_mushrooms <= 5 and \
             (len(self.bees)==0) and (self.spawn_queue['bees'] == 0):
-            n = random.randint(1,5)
+            n = self.rand.randint(1,5)
             self.spawn_queue['bees'] += n
 
         if self.random_event_delay:
@@ -1260,6 +1575,533 @@ class Game:
                 self.spawn_queue['earwigs'] += 1
 
 
+#####################################################################
+
+class RandomStream:
+    """A subsystem's view of the game random number generator.
+
+    All streams of a game share one generator so a game can be
+    reproduced from its seed; each stream counts its draws in the
+    shared counts dict under its own name.
+    """
+
+    def __init__(self, rng, counts, name):
+        self.rng = rng
+        self.counts = counts
+        self.name = name
+        self.counts.setdefault(name, 0)
+
+    def randint(self, a, b):
+        self.counts[self.name] += 1
+        return self.rng.randint(a, b)
+
+    def randrange(self, start, stop=None, step=1):
+        self.counts[self.name] += 1
+        return self.rng.randrange(start, stop, step)
+
+    def shuffle(self, x):
+        # shuffle draws once for every element but the first
+        self.counts[self.name] += max(len(x) - 1, 0)
+        self.rng.shuffle(x)
+
+
+#####################################################################
+
+class InputRecorder:
+    """Records the keys vector of every game frame to a file.
+
+    The file starts with a header (magic, version, frame rate, seed)
+    followed by run-length encoded frames: one byte of key bits (bit n
+    set when keys[n] is held) and a 16-bit repeat count.
+    """
+
+    MAGIC = 'MMRP'
+    # bumped whenever seeded games stop playing out as they used to,
+    # recordings of older builds would no longer replay the same game
+    VERSION = 2
+    HEADER = '<4sBHI'
+    RUN = '<BH'
+    MAX_RUN = 0xffff
+
+    def __init__(self, filename, frame_rate=Game.FRAME_RATE):
+        self.filename = filename
+        self.frame_rate = frame_rate
+        self.file = None
+
+    def start(self, seed):
+        """Start recording a new game played with seed."""
+        self.stop()
+        self.file = open(self.filename, 'wb')
+        self.file.write(struct.pack(InputRecorder.HEADER,
+            InputRecorder.MAGIC, InputRecorder.VERSION,
+            self.frame_rate, seed))
+        self.bits = 0
+        self.count = 0
+        self.frames = 0
+
+    def record(self, keys):
+        """Record the keys vector of one frame."""
+        if not self.file:
+            return
+        bits = pack_keys(keys)
+        if (bits != self.bits) or (self.count == InputRecorder.MAX_RUN):
+            self.__write_run()
+            self.bits = bits
+        self.count += 1
+        self.frames += 1
+
+    def stop(self):
+        """Finish the recording and close the file."""
+        if not self.file:
+            return
+        self.__write_run()
+        self.file.close()
+        self.file = None
+        print "Recorded %d frames to %s" % (self.frames, self.filename)
+
+    def __write_run(self):
+        if self.count:
+            self.file.write(struct.pack(InputRecorder.RUN,
+                self.bits, self.count))
+        self.count = 0
+
+
+class InputReplay:
+    """Input policy that plays back a file written by InputRecorder.
+
+    Once the recording runs out no keys are held.
+    """
+
+    def __init__(self, filename):
+        data = open(filename, 'rb').read()
+        n = struct.calcsize(InputRecorder.HEADER)
+        (magic, version, self.frame_rate, self.seed) = \
+         struct.unpack(InputRecorder.HEADER, data[:n])
+        if magic != InputRecorder.MAGIC:
+            raise ValueError("%s is not an input recording" % filename)
+        if version != InputRecorder.VERSION:
+            raise ValueError("%s was recorded by another version (%d)" % \
+             (filename, version))
+
+        self.runs = []
+        self.frames = 0
+        m = struct.calcsize(InputRecorder.RUN)
+        for i in xrange(n, len(data), m):
+            (bits, count) = struct.unpack(InputRecorder.RUN, data[i:i+m])
+            self.runs.append((unpack_keys(bits), count))
+            self.frames += count
+
+        self.run_idx = 0
+        self.remaining = 0
+        self.keys = [False, False, False, False, False]
+
+    def get_keys(self, game):
+        """Return the keys vector of the next frame."""
+        if self.remaining == 0:
+            if self.run_idx < len(self.runs):
+                (self.keys, self.remaining) = self.runs[self.run_idx]
+                self.run_idx += 1
+            else:
+                self.keys = [False, False, False, False, False]
+                self.remaining = -1
+        self.remaining -= 1
+        return list(self.keys)
+
+
+class RandomPolicy:
+    """Input policy that mashes random keys.
+
+    Holds a random direction for a random number of frames and keeps
+    the fire button down most of the time. It has its own generator so
+    it does not disturb the random sequence of the game.
+    """
+
+    def __init__(self, seed=None):
+        self.rand = random.Random(seed)
+        self.frames = 0
+        self.keys = [False, False, False, False, False]
+
+    def get_keys(self, game):
+        """Return the keys vector of the next frame."""
+        if self.frames == 0:
+            self.frames = self.rand.randint(5, 60)
+            self.keys = [self.rand.random() < 0.5 for i in xrange(4)]
+            self.keys.append(self.rand.random() < 0.9)
+        self.frames -= 1
+        return list(self.keys)
+
+
+class ScriptedPolicy:
+    """Input policy that loops over a script of (frames, keys) steps."""
+
+    # sweep the player area left and right while firing
+    SWEEP = ((60, [True, False, False, False, True]),
+             (60, [False, True, False, False, True]))
+
+    def __init__(self, script=SWEEP):
+        self.script = script
+        self.step = -1
+        self.frames = 0
+
+    def get_keys(self, game):
+        """Return the keys vector of the next frame."""
+        if self.frames == 0:
+            self.step = (self.step + 1) % len(self.script)
+            self.frames = self.script[self.step][0]
+        self.frames -= 1
+        return list(self.script[self.step][1])
+
+
+#####################################################################
+
+class Snapshot:
+    """A read-only view of the game handed to a Bot every frame.
+
+    Rects are (x, y, w, h) tuples. The lists of segments, monsters and
+    DDTs are only built when a bot first asks for them, so a bot pays
+    for what it looks at.
+    """
+
+    def __init__(self, game):
+        self.__game = game
+        self.score = game.score
+        self.level = game.cur_level
+        self.lives = game.player_lives
+        r = game.player.rect
+        self.player = (r.left, r.top, r.width, r.height)
+        self.missile_active = game.playerMissile.active
+        self.__segments = None
+        self.__monsters = None
+        self.__ddts = None
+
+
+    def segments(self):
+        """Return the (x, y) of every Millipede segment."""
+        if self.__segments == None:
+            pool = self.__game.segments
+            x = pool.x
+            y = pool.y
+            self.__segments = [(x[i], y[i]) for (i, owner) in \
+             enumerate(pool.owner) if owner != None]
+        return self.__segments
+
+
+    def monsters(self):
+        """Return the (class name, rect) of every monster."""
+        if self.__monsters == None:
+            self.__monsters = [(m.__class__.__name__, (m.rect.left,
+             m.rect.top, m.rect.width, m.rect.height)) \
+             for m in self.__game.monsters]
+        return self.__monsters
+
+
+    def ddts(self):
+        """Return the (rect, active) of every DDT."""
+        if self.__ddts == None:
+            self.__ddts = [((d.rect.left, d.rect.top, d.rect.width,
+             d.rect.height), d.active) for d in self.__game.ddts]
+        return self.__ddts
+
+
+    def mushroom(self, fx, fy):
+        """Return the hit points of the mushroom at field cell fx,fy,
+        0 when there is none."""
+        if (fx < 0) or (fx >= MushroomField.FIELD_WIDTH) or \
+         (fy < 0) or (fy >= MushroomField.FIELD_HEIGHT):
+            return 0
+        field = self.__game.mushroom_field
+        return field.hp[field.cell(fy * MushroomField.FIELD_WIDTH + fx)]
+
+
+class Bot:
+    """Input policy which plays the game from a Snapshot.
+
+    Subclasses implement decide(), which returns the keys vector:
+    [left, right, up, down, fire].
+    """
+
+    def get_keys(self, game):
+        """Return the keys vector of the next frame."""
+        return self.decide(Snapshot(game))
+
+    def decide(self, snap):
+        return [False, False, False, False, False]
+
+
+class GreedyShooter(Bot):
+    """Bot which stands under the nearest target and keeps firing.
+
+    Millipede segments come first, the lowest one, then monsters.
+    """
+
+    # pixels off target still counted as lined up
+    SLACK = 3
+
+    def decide(self, snap):
+        (x, y, w, h) = snap.player
+        px = x + w / 2
+        target = self.target(snap, px)
+        keys = [False, False, False, False, True]
+        if target != None:
+            dx = target - px
+            keys[0] = dx < -GreedyShooter.SLACK
+            keys[1] = dx > GreedyShooter.SLACK
+        return keys
+
+    def target(self, snap, px):
+        """Return the x to line up with, None when there is nothing
+        to shoot."""
+        best = None
+        for (sx, sy) in snap.segments():
+            sx += Millipede.WIDTH / 2
+            key = (-sy, abs(sx - px))
+            if best == None or key < best[0]:
+                best = (key, sx)
+        if best != None:
+            return best[1]
+        for (name, (mx, my, mw, mh)) in snap.monsters():
+            mx += mw / 2
+            if best == None or abs(mx - px) < best[0]:
+                best = (abs(mx - px), mx)
+        if best != None:
+            return best[1]
+        return None
+
+
+class Dodger(GreedyShooter):
+    """Bot which shoots like a GreedyShooter but first steps away from
+    anything coming within reach of the player."""
+
+    # how close a monster or segment may get, in pixels
+    REACH = 36
+
+    def decide(self, snap):
+        (x, y, w, h) = snap.player
+        px = x + w / 2
+        py = y + h / 2
+        near = None
+        threats = [(tx + tw / 2, ty + th / 2) for (name, (tx, ty, tw, th)) \
+         in snap.monsters()]
+        threats.extend([(tx + Millipede.WIDTH / 2, ty + Millipede.HEIGHT / 2)
+         for (tx, ty) in snap.segments()])
+        for (tx, ty) in threats:
+            d = max(abs(tx - px), abs(ty - py))
+            if d < Dodger.REACH and (near == None or d < near[0]):
+                near = (d, tx, ty)
+        if near == None:
+            return GreedyShooter.decide(self, snap)
+        (d, tx, ty) = near
+        # step away, keeping the fire button down
+        return [tx >= px, tx < px, ty > py, ty <= py, True]
+
+
+# bots by name, see --bot
+BOTS = {
+    'greedy' : GreedyShooter,
+    'dodger' : Dodger,
+}
+
+
+def pack_keys(keys):
+    """Pack a keys vector into an integer, bit n is keys[n]."""
+    bits = 0
+    for i in xrange(len(keys)):
+        if keys[i]:
+            bits |= 1 << i
+    return bits
+
+def unpack_keys(bits):
+    """Unpack an integer made by pack_keys into a keys vector."""
+    return [((bits >> i) & 1) == 1 for i in xrange(5)]
+
+
+#####################################################################
+
+class WallClock:
+    """Game time read from the real time clock."""
+
+    def get_ticks(self):
+        """Return milliseconds since pygame.init()."""
+        return pygame.time.get_ticks()
+
+    def tick(self):
+        """Called once per frame, the wall clock runs by itself."""
+        pass
+
+
+class VirtualClock:
+    """Game time that advances by a fixed timestep per frame.
+
+    Every frame lasts exactly 1/frame_rate seconds of game time no
+    matter how fast or slow the frames are actually computed, so a
+    simulation running flat out behaves exactly like a 60 FPS session.
+    """
+
+    def __init__(self, frame_rate=Game.FRAME_RATE):
+        self.frame_rate = frame_rate
+        self.frames = 0
+
+    def get_ticks(self):
+        """Return milliseconds of game time simulated so far."""
+        return (self.frames * 1000) / self.frame_rate
+
+    def tick(self):
+        """Advance game time by one frame."""
+        self.frames += 1
+
+
+#####################################################################
+
+class NoProfiler:
+    """A profiler which measures nothing -- see FrameProfiler."""
+
+    show = False
+
+    def start(self):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+    def save(self):
+        pass
+
+
+class FrameProfiler:
+    """Wall clock time spent in each phase of every frame.
+
+    start() begins a frame, lap(name) charges the time since the
+    previous lap to the phase called name and stop() ends the frame.
+    The last max_frames frames are kept, save() writes them to the
+    trace file: JSON when its name ends in .json, CSV otherwise.
+
+    When show is set draw() puts the average and worst time of every
+    phase over the last second on screen.
+    """
+
+    # frames averaged by the overlay
+    WINDOW = 60
+    # seconds between overlay refreshes
+    REFRESH = 0.5
+
+    def __init__(self, trace=None, max_frames=600):
+        self.trace = trace
+        self.frames = collections.deque(maxlen=max_frames)
+        self.phases = []
+        self.frame_count = 0
+        self.frame = None
+        self.start_time = 0.0
+        self.mark = 0.0
+
+        self.show = False
+        self.text = None
+        self.overlay = None
+        self.overlay_time = 0.0
+
+
+    def start(self):
+        """Begin timing a frame."""
+        self.frame_count += 1
+        self.frame = {}
+        self.start_time = self.mark = time.time()
+
+
+    def lap(self, name):
+        """Charge the time since the last lap to phase name."""
+        now = time.time()
+        frame = self.frame
+        if frame == None:
+            return
+        if name in frame:
+            frame[name] += now - self.mark
+        else:
+            frame[name] = now - self.mark
+            if name not in self.phases:
+                self.phases.append(name)
+        self.mark = now
+
+
+    def stop(self):
+        """End the frame."""
+        if self.frame == None:
+            return
+        total = time.time() - self.start_time
+        self.frames.append((self.frame_count, total, self.frame))
+        self.frame = None
+
+
+    def summary(self, n=0):
+        """Return (name, average, worst) seconds of the frame and of
+        every phase over the last n frames, all frames when n is 0."""
+        frames = list(self.frames)[-n:]
+        if not frames:
+            return []
+        totals = [total for (count, total, phases) in frames]
+        lines = [('frame', sum(totals) / len(frames), max(totals))]
+        for name in self.phases:
+            times = [phases.get(name, 0.0) for (count, total, phases) \
+             in frames]
+            lines.append((name, sum(times) / len(frames), max(times)))
+        return lines
+
+
+    def draw(self, buffer):
+        """Draw the timings at the top left of buffer and return the
+        rect drawn."""
+        now = time.time()
+        if self.overlay == None or (now - self.overlay_time) > \
+         FrameProfiler.REFRESH:
+            self.overlay_time = now
+            self.render()
+        return buffer.blit(self.overlay, [0,0])
+
+
+    def render(self):
+        """Render the overlay."""
+        if self.text == None:
+            self.text = TextCache(pygame.font.SysFont(None, 16))
+        lines = [('ms', 'avg', 'max')]
+        for (name, avg, worst) in self.summary(FrameProfiler.WINDOW):
+            lines.append((name, "%6.2f" % (avg * 1000.0),
+             "%6.2f" % (worst * 1000.0)))
+        h = self.text.font.get_linesize()
+        self.overlay = pygame.Surface([200, h * len(lines) + 4])
+        self.overlay.fill([0,0,0])
+        y = 2
+        for (name, avg, worst) in lines:
+            self.text.compose(self.overlay, name, [2,y])
+            self.text.compose(self.overlay, avg, [110,y])
+            self.text.compose(self.overlay, worst, [155,y])
+            y += h
+
+
+    def save(self):
+        """Write the kept frames to the trace file, if any."""
+        if not self.trace:
+            return
+        f = open(self.trace, 'w')
+        if self.trace.endswith('.json'):
+            frames = []
+            for (count, total, phases) in self.frames:
+                ms = dict([(name, t * 1000.0) for (name, t) \
+                 in phases.items()])
+                frames.append({'frame' : count, 'total' : total * 1000.0,
+                 'phases' : ms})
+            json.dump({'unit' : 'ms', 'frames' : frames}, f, indent=1,
+             sort_keys=True)
+        else:
+            f.write(",".join(['frame', 'total'] + self.phases) + "\n")
+            for (count, total, phases) in self.frames:
+                row = ["%d" % count, "%.3f" % (total * 1000.0)]
+                for name in self.phases:
+                    row.append("%.3f" % (phases.get(name, 0.0) * 1000.0))
+                f.write(",".join(row) + "\n")
+        f.close()
+
+
 #####################################################################
 
 class Player(pygame.sprite.Sprite):
@@ -1303,8 +2145,7 @@ class Player(pygame.sprite.Sprite):
     def reset(self):
         self.rect.topleft = (Player.START_X, Player.START_Y)
         # stop all sounds
-        if pygame.mixer.get_init():
-            pygame.mixer.stop()
+        self.game.sounds.stop()
         self.game.player_hit_snd.play()
         self.game.mushroom_field.clear_player_area()
 
@@ -1313,17 +2154,12 @@ class Player(pygame.sprite.Sprite):
         # check for collision against any monsters
 
         if not DEBUG:
-            rect_list = []
-            for m in self.game.millipedes:
-                for b in m.body:
-                    rect_list.append( b['rect'] )
-
-            if self.rect.collidelist(rect_list) > -1:
+            if self.game.segments.hit_any(self.rect):
                 self.reset()
                 self.game.player_dead = True
                 self.game.stop_ninth_millipede()
 
-            m_lst = pygame.sprite.spritecollide(self, self.game.monsters, False)
+            m_lst = self.game.monsters.collide(self.rect)
             if len(m_lst):
                 self.reset()
                 self.game.player_dead = True
@@ -1435,7 +2271,7 @@ class PlayerMissile(pygame.sprite.Sprite):
             # check for collision against mushroom
             self.rect.topleft = self.x, self.y
 
-            for d in self.game.ddts:
+            for d in self.game.ddts.collide(self.rect):
                 if d.collision(self.rect):
                     self.active = False
                     self.game.ddt_snd.play()
@@ -1448,13 +2284,14 @@ class PlayerMissile(pygame.sprite.Sprite):
                 return
 
             # 2nd -- check for collision against monsters
-            for m in self.game.millipedes:
-                if m.collision(self.rect):
-                    self.active = False
-                    self.game.particles.add(self.x,self.y)
-                    return
+            if self.game.segments.hit_any(self.rect):
+                for m in self.game.millipedes:
+                    if m.collision(self.rect):
+                        self.active = False
+                        self.game.particles.add(self.x,self.y)
+                        return
 
-            m_lst = pygame.sprite.spritecollide(self,self.game.monsters,False)
+            m_lst = self.game.monsters.collide(self.rect)
 
             if len(m_lst):
                 self.active = False
@@ -1473,6 +2310,261 @@ class PlayerMissile(pygame.sprite.Sprite):
 #####################################################################
 
 
+class SpatialHash:
+    """A uniform grid of the objects in the arena.
+
+    The cells of the grid are span x span MushroomField cells. An
+    object is filed under the cell holding the top left corner of its
+    rect, so moving it costs nothing until it crosses into another
+    cell. A query looks in every cell which could hold the corner of
+    an object overlapping the query rect: no object is larger than
+    the largest one filed, and an object may have moved up to drift
+    pixels since it was filed.
+    """
+
+    def __init__(self, span=1, drift=0):
+        self.cell_w = span * MushroomField.MUSHROOM_WIDTH
+        self.cell_h = span * MushroomField.MUSHROOM_HEIGHT
+        self.drift = drift
+        self.max_w = 0
+        self.max_h = 0
+        self.cell_map = {}
+        self.keys = {}
+
+
+    def place(self, obj, x, y, w, h):
+        """File obj, which is w x h in size, at x,y."""
+        if w > self.max_w:
+            self.max_w = w
+        if h > self.max_h:
+            self.max_h = h
+        # columns run off the edge of the grid into the next row's
+        # keys, which only costs an extra exact test
+        k = ((y // self.cell_h) << 6) + (x // self.cell_w)
+        old = self.keys.get(obj)
+        if old == k:
+            return
+        if old != None:
+            self.__unfile(obj, old)
+        if k in self.cell_map:
+            self.cell_map[k].append(obj)
+        else:
+            self.cell_map[k] = [obj]
+        self.keys[obj] = k
+
+
+    def remove(self, obj):
+        """Forget obj."""
+        k = self.keys.pop(obj, None)
+        if k != None:
+            self.__unfile(obj, k)
+
+
+    def clear(self):
+        """Forget every object."""
+        self.cell_map = {}
+        self.keys = {}
+
+
+    def near(self, rect):
+        """Return the objects which may overlap rect."""
+        found = []
+        cell_map = self.cell_map
+        col0 = (rect.left - self.max_w - self.drift) // self.cell_w
+        col1 = (rect.right + self.drift - 1) // self.cell_w
+        for row in xrange((rect.top - self.max_h - self.drift) // self.cell_h,
+         (rect.bottom + self.drift - 1) // self.cell_h + 1):
+            row <<= 6
+            for col in xrange(col0, col1 + 1):
+                objs = cell_map.get(row + col)
+                if objs:
+                    found.extend(objs)
+        return found
+
+
+    def __unfile(self, obj, k):
+        """Remove obj from cell k."""
+        objs = self.cell_map[k]
+        objs.remove(obj)
+        if not objs:
+            del self.cell_map[k]
+
+
+class GridGroup(pygame.sprite.OrderedUpdates):
+    """An ordered sprite group which files its sprites in a SpatialHash.
+
+    Call refile() after the sprites move. collide() answers what
+    pygame.sprite.spritecollide() does, in group order, but only tests
+    the sprites near the rect.
+    """
+
+    def __init__(self, *sprites):
+        self.grid = SpatialHash()
+        self.order = {}
+        self.next_order = 0
+        pygame.sprite.OrderedUpdates.__init__(self, *sprites)
+
+
+    def add_internal(self, sprite, *args):
+        pygame.sprite.OrderedUpdates.add_internal(self, sprite, *args)
+        self.order[sprite] = self.next_order
+        self.next_order += 1
+        self.refile(sprite)
+
+
+    def remove_internal(self, sprite):
+        pygame.sprite.OrderedUpdates.remove_internal(self, sprite)
+        del self.order[sprite]
+        self.grid.remove(sprite)
+
+
+    def refile(self, sprite=None):
+        """File sprite, or every sprite, at its current rect."""
+        if sprite != None:
+            if sprite not in self.order:
+                return
+            r = sprite.rect
+            self.grid.place(sprite, r.left, r.top, r.width, r.height)
+        else:
+            place = self.grid.place
+            for s in self._spritelist:
+                r = s.rect
+                place(s, r.left, r.top, r.width, r.height)
+
+
+    def collide(self, rect):
+        """Return the sprites overlapping rect in group order."""
+        hits = [s for s in self.grid.near(rect) if rect.colliderect(s.rect)]
+        if len(hits) > 1:
+            hits.sort(key=self.order.__getitem__)
+        return hits
+
+
+#####################################################################
+
+
+class SegmentPool:
+    """Millipede body segments.
+
+    The segments of every Millipede live in parallel arrays and a
+    Millipede's body is a list of segment ids -- indices into the
+    arrays. The head steers, the rest of the body follows its trail
+    -- see Millipede.crawl().
+
+    x, y - screen position of the segment
+    dx, dy - heading of the segment, pixels per move, only kept up
+    to date for heads
+    owner - the Millipede the segment belongs to
+    slot - index of the segment in its owner's body
+
+    At every waypoint a segment is filed in a SpatialHash -- see
+    place() -- so collisions only test the segments near a rect.
+    Until the next waypoint a segment moves at most one move away from
+    where it was filed.
+    """
+
+    # grid cells are four by four segments
+    GRID_SPAN = 4
+
+    def __init__(self):
+        self.x = array.array('i')
+        self.y = array.array('i')
+        self.dx = array.array('i')
+        self.dy = array.array('i')
+        self.owner = []
+        self.slot = array.array('i')
+        self.grid = SpatialHash(SegmentPool.GRID_SPAN,
+         Millipede.move_inc * Millipede.MOVE_COUNT)
+        self.free_ids = []
+
+
+    def alloc(self, x, y, owner, slot):
+        """Return the id of a new segment of owner at x,y."""
+        if self.free_ids:
+            i = self.free_ids.pop()
+            self.x[i] = x
+            self.y[i] = y
+            self.dx[i] = 0
+            self.dy[i] = 0
+            self.owner[i] = owner
+            self.slot[i] = slot
+        else:
+            i = len(self.x)
+            self.x.append(x)
+            self.y.append(y)
+            self.dx.append(0)
+            self.dy.append(0)
+            self.owner.append(owner)
+            self.slot.append(slot)
+        return i
+
+
+    def free(self, ids):
+        """Return segments ids to the pool."""
+        for i in ids:
+            self.grid.remove(i)
+            self.owner[i] = None
+        self.free_ids.extend(ids)
+
+
+    def clear(self):
+        """Free every segment."""
+        del self.x[:]
+        del self.y[:]
+        del self.dx[:]
+        del self.dy[:]
+        del self.slot[:]
+        self.owner = []
+        self.grid.clear()
+        self.free_ids = []
+
+
+    def set_owner(self, ids, owner):
+        """Make segments ids the body of owner."""
+        slot = self.slot
+        n = 0
+        for i in ids:
+            self.owner[i] = owner
+            slot[i] = n
+            n += 1
+
+
+    def place(self, i):
+        """File segment i where it is."""
+        self.grid.place(i, self.x[i], self.y[i],
+         Millipede.WIDTH, Millipede.HEIGHT)
+
+
+    def hit_any(self, rect):
+        """True if any segment overlaps rect."""
+        return self.find(None, rect) > -1
+
+
+    def find(self, owner, rect):
+        """Return the body slot of the first segment of owner
+        overlapping rect, -1 if there is none. With no owner, return
+        the slot of any overlapping segment."""
+        w = Millipede.WIDTH
+        h = Millipede.HEIGHT
+        left = rect.left - w
+        top = rect.top - h
+        right = rect.right
+        bottom = rect.bottom
+        x = self.x
+        y = self.y
+        best = -1
+        for i in self.grid.near(rect):
+            if (left < x[i] < right) and (top < y[i] < bottom):
+                if owner == None:
+                    return self.slot[i]
+                if (self.owner[i] is owner) and \
+                 ((best < 0) or (self.slot[i] < best)):
+                    best = self.slot[i]
+        return best
+
+
+#####################################################################
+
 class Millipede:
     """The Millipede."""
 
@@ -1502,6 +2594,7 @@ class Millipede:
         """
 
         self.game = game
+        self.rand = game.random_stream('millipede')
         
         if Millipede.frames == None:
             Millipede.frames = []
@@ -1521,7 +2614,7 @@ class Millipede:
         self.up = False
         self.down = True
 
-        n = random.randint(0,10)
+        n = self.rand.randint(0,10)
         if n < 5:
             self.left = True
             self.right = False
@@ -1548,28 +2641,39 @@ class Millipede:
         else:
             x, y = start_pos
 
-        # millipede's body is an array of dictionaries
-        # representing each segment of the body
+        # millipede's body is a list of segment ids, the head
+        # first -- see SegmentPool
 
+        self.segments = game.segments
         self.body = []
 
-        for i in range(0,num_segments):
-            # each segment of the millipede's body is
-            # represented by a dictionary which holds
-            # the segments position and heading
-            m = {}
-            if i == 0:
-                m['head'] = True
-
-            m['x_pos'] = x
-            m['y_pos'] = y
-            m['dx'] = 0
-            m['dy'] = 0
-            m['rect'] = pygame.Rect( x, y, Millipede.WIDTH, Millipede.HEIGHT )
-
-            y = y - Millipede.HEIGHT
+        """
+        The head writes every position it steps to in the trail ring
+        buffer. Segments are a move -- MOVE_COUNT steps -- apart, so
+        segment i is always where the head was i * MOVE_COUNT steps
+        ago and the body only ever reads the trail -- see crawl().
+        The Millipede enters the arena straight down, the trail starts
+        out as a line of steps up from the head.
+
+        Every position is written twice, size apart, so the positions
+        of the whole body are always one slice of the trail.
+        """
+        size = 1
+        while size <= num_segments * Millipede.MOVE_COUNT:
+            size <<= 1
+        self.trail_mask = size - 1
+        self.trail_x = array.array('i', [x]) * (size * 2)
+        self.trail_y = array.array('i', [0]) * (size * 2)
+        for i in xrange(0, size):
+            j = -i & self.trail_mask
+            self.trail_y[j] = self.trail_y[j + size] = \
+             y - (i * Millipede.move_inc)
+        # the head's position in the trail
+        self.trail_end = 0
 
-            self.body.append( m )
+        for i in range(0,num_segments):
+            self.body.append( self.segments.alloc(x, y, self, i) )
+            y = y - (Millipede.MOVE_COUNT * Millipede.move_inc)
 
         self.x_inc = 0
         self.y_inc = Millipede.move_inc
@@ -1587,23 +2691,28 @@ class Millipede:
                 self.cur_frame = 0
             self.image = Millipede.frames[self.cur_frame]
 
+        x = self.segments.x
+        y = self.segments.y
+        rects = []
         for m in self.body:
-            buffer.blit( self.image, (m['x_pos'],m['y_pos']) )
+            rects.append(buffer.blit( self.image, (x[m],y[m]) ))
+        return rects
 
 
     def __change_row(self, head):
         """Move the Millipede up or down."""
+        head_y = self.segments.y[head]
         if self.down:
-            x = head['x_pos']
-            y = head['y_pos'] + Millipede.HEIGHT
+            x = self.segments.x[head]
+            y = head_y + Millipede.HEIGHT
         elif self.up:
-            x = head['x_pos']
-            y = head['y_pos'] - Millipede.HEIGHT
+            x = self.segments.x[head]
+            y = head_y - Millipede.HEIGHT
         
         if y >= (Game.ARENA_H-Millipede.HEIGHT):
             self.down = False
             self.up = True
-            y = head['y_pos'] + Millipede.HEIGHT
+            y = head_y + Millipede.HEIGHT
             self.max_y = Millipede.MAX_Y
             # trigger Millipede spawn in player area
             self.game.spawn_millipede_in_player_area()
@@ -1611,26 +2720,19 @@ class Millipede:
         if y < self.max_y: 
             self.down = True
             self.up = False
-            y = head['y_pos'] - Millipede.HIEGHT
+            y = head_y - Millipede.HIEGHT
 
 
     def move(self):
+        """Steer the Millipede, returns True when its body moves a
+        step along its heading this frame -- see Game.move_millipedes."""
         # move head & move body
-        head = self.body[0]
-
-        if not head:
-            return
+        if not self.body:
+            return False
 
         if self.move_count > 0:
             self.move_count -= 1
-
-            for m in self.body:
-                m['prev_x'] = m['x_pos']
-                m['prev_y'] = m['y_pos']
-                m['x_pos'] += m['dx']
-                m['y_pos'] += m['dy']
-                m['rect'].top = m['y_pos']
-                m['rect'].left = m['x_pos']
+            return True
 
         else:
             # reset movement counter
@@ -1641,41 +2743,45 @@ class Millipede:
             alternate_dir = False
             random_dir = False
 
-            x = head['x_pos']
-            y = head['y_pos']
+            head = self.body[0]
+            head_x = self.segments.x[head]
+            head_y = self.segments.y[head]
+
+            x = head_x
+            y = head_y
 
             # was moving left
             if self.left and not self.change_row:
-                if head['x_pos'] > 0:
-                    x = head['x_pos'] - Millipede.WIDTH
-                    y = head['y_pos']
+                if head_x > 0:
+                    x = head_x - Millipede.WIDTH
+                    y = head_y
 
-                elif head['x_pos'] == 0:
+                elif head_x == 0:
                     self.change_row = True
 
             # was moving right
             elif self.right and not self.change_row:
                 x_max = Game.ARENA_W - Millipede.WIDTH
-                if head['x_pos'] < x_max:
-                    x = head['x_pos'] + Millipede.WIDTH
-                    y = head['y_pos']
-                elif head['x_pos'] == x_max:
+                if head_x < x_max:
+                    x = head_x + Millipede.WIDTH
+                    y = head_y
+                elif head_x == x_max:
                     self.change_row = True
 
             # change rows up or down if needed
             if self.change_row:
                 if self.down:
-                    x = head['x_pos']
-                    y = head['y_pos'] + Millipede.HEIGHT
+                    x = head_x
+                    y = head_y + Millipede.HEIGHT
                 elif self.up:
-                    x = head['x_pos']
-                    y = head['y_pos'] - Millipede.HEIGHT
+                    x = head_x
+                    y = head_y - Millipede.HEIGHT
 
                 if y >= (Game.ARENA_H-Millipede.HEIGHT):
                     random_dir = True
                     self.down = False
                     self.up = True
-                    y = head['y_pos'] + Millipede.HEIGHT
+                    y = head_y + Millipede.HEIGHT
                     self.max_y = Millipede.MAX_Y
                     # trigger Millipede spawn in player area
                     self.game.spawn_millipede_in_player_area()
@@ -1687,7 +2793,7 @@ class Millipede:
                 if y < self.max_y:
                     self.down = True
                     self.up = False
-                    y = head['y_pos'] - Millipede.HEIGHT
+                    y = head_y - Millipede.HEIGHT
 
                 if not self.poisoned: 
                     self.change_row = False
@@ -1723,7 +2829,7 @@ class Millipede:
 
             # alternate between left/right movement
             if alternate_dir:
-                #n = random.randint(0,10)
+                #n = self.rand.randint(0,10)
                 if self.left:
                     self.left = False
                     self.right = True
@@ -1733,7 +2839,7 @@ class Millipede:
 
             # make Millipede more eratic if in player area
             if random_dir:
-                n = random.randint(0,10)
+                n = self.rand.randint(0,10)
                 if n < 5:
                     self.left = True
                     self.right = False
@@ -1749,106 +2855,144 @@ class Millipede:
             # to the body
             #
             self.set_waypoint( x, y )
+            return False
 
     def set_waypoint(self, x, y):
         """set target position for Millipede to move towards."""
+        # only the head is steered, the body follows its trail
+        head = self.body[0]
+        x1 = self.segments.x[head]
+        y1 = self.segments.y[head]
         # need to handle special case where both dy and y are negative
         # ie. we are just starting to move into the board
-        x0 = x
-        y0 = y
+        if (y < 0) or (y1 < 0):
+            self.segments.dx[head] = 0
+            self.segments.dy[head] = Millipede.move_inc
+        else:
+            self.segments.dx[head] = cmp(x, x1) * Millipede.move_inc
+            self.segments.dy[head] = cmp(y, y1) * Millipede.move_inc
+
+        place = self.segments.place
         for m in self.body:
-            x1 = m['x_pos']
-            y1 = m['y_pos']
-            if (y0 < 0) or (m['y_pos'] < 0):
-                m['dx'] = 0
-                m['dy'] = Millipede.move_inc
-            else:
-                dx = x0 - m['x_pos']
-                dy = y0 - m['y_pos']
+            place(m)
+
+
+    def crawl(self):
+        """Move the head a step along its heading, and the body after
+        it along the trail."""
+        seg_x = self.segments.x
+        seg_y = self.segments.y
+        trail_x = self.trail_x
+        trail_y = self.trail_y
+        size = self.trail_mask + 1
+        head = self.body[0]
+        i = (self.trail_end + 1) & self.trail_mask
+        self.trail_end = i
+        trail_x[i] = trail_x[i + size] = \
+         seg_x[head] + self.segments.dx[head]
+        trail_y[i] = trail_y[i + size] = \
+         seg_y[head] + self.segments.dy[head]
+        # the body, head first, every MOVE_COUNT steps back
+        i += size
+        j = i - (len(self.body) * Millipede.MOVE_COUNT)
+        for (m, x, y) in itertools.izip(self.body,
+         trail_x[i:j:-Millipede.MOVE_COUNT],
+         trail_y[i:j:-Millipede.MOVE_COUNT]):
+            seg_x[m] = x
+            seg_y[m] = y
+
+
+    def __follow(self, n):
+        """Make the body segment n places behind the head the new
+        head, the body has already been cut to start with it."""
+        mask = self.trail_mask
+        i = (self.trail_end - (n * Millipede.MOVE_COUNT)) & mask
+        self.trail_end = i
+        # keep the new head stepping along the trail until the next
+        # waypoint
+        j = (i + 1) & mask
+        head = self.body[0]
+        self.segments.dx[head] = self.trail_x[j] - self.trail_x[i]
+        self.segments.dy[head] = self.trail_y[j] - self.trail_y[i]
 
-                if dx > 0:
-                    m['dx'] = Millipede.move_inc
-                elif dx < 0:
-                    m['dx'] = -Millipede.move_inc
-                else:
-                    m['dx'] = 0
-                
-                if dy > 0:
-                    m['dy'] = Millipede.move_inc
-                elif dy < 0:
-                    m['dy'] = -Millipede.move_inc
-                else:
-                    m['dy'] = 0
-                    
-            x0 = x1
-            y0 = y1
-    
 
     def collision(self, rect):
         """check for collision against other sprite."""
-        m_rect = pygame.Rect(0,0,Millipede.WIDTH,Millipede.HEIGHT)
-        hit = False
-        for m in self.body:
-            m_rect.left = m['x_pos']
-            m_rect.top = m['y_pos']
-            if m_rect.colliderect( rect ):
+        index = self.segments.find(self, rect)
+        if index < 0:
+            return False
 
-                self.game.stop_ninth_millipede()
+        self.game.stop_ninth_millipede()
 
-                hit = True
+        body = self.body
+        m = body[index]
+        x = self.segments.x[m]
+        y = self.segments.y[m]
 
-                fx = m['x_pos'] / MushroomField.MUSHROOM_WIDTH
-                fy = m['y_pos'] / MushroomField.MUSHROOM_WIDTH
+        fx = x / MushroomField.MUSHROOM_WIDTH
+        fy = y / MushroomField.MUSHROOM_WIDTH
 
-                self.game.mushroom_field.add_mushroom( fx, fy )
+        self.game.mushroom_field.add_mushroom( fx, fy )
 
-                """ 
-                split the millipede body at segment where collision
-                occurrs and create a new instance of millipede
-                """
+        # determine score
+        if index == 0:
+            self.game.score += Millipede.HEAD_POINTS
+            self.game.popups.add(x, y, Millipede.HEAD_POINTS)
+        else:
+            self.game.score += Millipede.BODY_POINTS
 
-                index = self.body.index( m )
-                n = len(self.body)
+        """ 
+        split the millipede body at segment where collision
+        occurrs: the segments in front of it stay with this
+        Millipede and the ones behind it make a new Millipede. The hit
+        segment and the tail segment are lost.
+        """
 
-                # determine score
-                if index == 0:
-                    self.game.score += Millipede.HEAD_POINTS
-                    self.game.popups.add(
-                    m['x_pos'],
-                    m['y_pos'],
-                    Millipede.HEAD_POINTS)
-                else:
-                    self.game.score += Millipede.BODY_POINTS
+        n = len(body)
+        if n == 1:
+            # nothing of the Millipede remains kill it
+            self.segments.free(body)
+            self.game.millipedes.remove( self )
+            return True
 
-                # split Millipede if it has segments
-                if n > 1:
-                    # make millipede dive down if split
-                    self.change_row = True
-                    # split body into two parts 
-                    n -= 1
-                    body0 = self.body[0:index]
-                    index += 1
-                    body1 = self.body[index:n]
-                    if (len(body0) == 0) and (len(body1) == 0):
-                        self.game.millipedes.remove(self)
-                        break
-
-                    if body0 != []:
-                        self.body = body0
-                        n = len(body1)
-                        if n > 0:
-                            child = Millipede(self.game, -1)
-                            child.body = body1
-                            self.set_child_state( child )
-                            self.game.millipedes.append( child )
-                    else:
-                        self.body = body1
-                else:
-                    # nothing of the Millipede remains kill it
-                    self.game.millipedes.remove( self )
-                break
+        # make millipede dive down if split
+        self.change_row = True
+
+        tail = body[index+1:n-1]
+        self.segments.free(body[index:index+1] + body[max(index+1,n-1):])
+        del body[index:]
+
+        if not body:
+            if not tail:
+                self.game.millipedes.remove(self)
+            else:
+                self.body = tail
+                self.segments.set_owner(tail, self)
+                self.__follow(1)
+        elif tail:
+            self.game.millipedes.append( self.split(tail, index + 1) )
             
-        return hit
+        return True
+
+
+    def split(self, body, n):
+        """Return a new Millipede made of segments body, n places
+        behind the head, carrying on from where this Millipede is."""
+        # a copy shares the game state without rerunning __init__
+        child = copy.copy(self)
+        child.body = body
+        self.segments.set_owner(body, child)
+        # the child follows its own copy of the trail
+        child.trail_x = array.array('i', self.trail_x)
+        child.trail_y = array.array('i', self.trail_y)
+        child.__follow(n)
+        child.image = Millipede.frames[0]
+        child.frame_delay = self.game.get_ticks()
+        child.cur_frame = 0
+        child.pa_spawned = False
+        child.poisoned = False
+        self.set_child_state( child )
+        return child
 
     
     def go_left(self):
@@ -1890,6 +3034,9 @@ class MushroomField:
     images = None
     flower_img = None
     poisoned_img = None
+    tmp_rect = None
+    # columns a missile can hit by its x, nearest first
+    missile_cols = None
     
     colors = ( ([0,128,0], [0,164,0], [0,198,0], [0,255,0]), \
     ([100,15,100], [127,30,127], [191,45,191], [255, 60, 255]), \
@@ -1921,9 +3068,24 @@ class MushroomField:
     MOVE_ROW_DOWN = 0 
     MOVE_ROW_UP = 1 
 
+    # milliseconds a flower lasts before it wilts
+    FLOWER_TTL = 10000
+
+    # check the incremental mushroom counts against a full rescan
+    # after every scroll, restore and Birth and Death
+    CHECK_COUNTS = False
+
+    # bitboard of the cells Birth and Death may change -- every row
+    # but the last one
+    LIFE_MASK = (1 << (MAX_MUSHROOMS - FIELD_WIDTH)) - 1
+
+    # str.translate table mapping array bytes to '0' or '1'
+    BIT_TABLE = '0' + ('1' * 255)
+
     def __init__(self, game):
 
         self.game = game
+        self.rand = game.random_stream('mushroom_field')
 
         self.cur_color_idx = 0
         self.cur_color = MushroomField.colors[self.cur_color_idx]
@@ -1953,7 +3115,7 @@ class MushroomField:
 
             MushroomField.images = []
 
-            self.tmp_rect = pygame.Rect(3,3,\
+            MushroomField.tmp_rect = pygame.Rect(3,3,\
             MushroomField.MUSHROOM_WIDTH-3,\
             MushroomField.MUSHROOM_HEIGHT-3)
 
@@ -1966,77 +3128,231 @@ class MushroomField:
 
 
         """
-        Build the mushroom grid a dict of dicts representing 
-        mushroom_field in their various states. To start make
-        the grid empty of mushroom_field -- hp == 0
+        The mushroom grid is kept in parallel typed arrays, one per
+        cell attribute. To start the grid is empty of mushrooms --
+        hp == 0
 
         hp - 'hit points'
+        poisoned - 1 if an Earwig poisoned the mushroom
+        flower - 1 if a Beetle turned the mushroom into a flower
+        ttl - time the flower was created
+        ddt - 1 if a DDT covers the cell
+
+        The hp also corresponds to the index of the mushroom
+        image inside of the MushroomField.images array.
+
+        Field index i (row major, row 0 at the top of the arena) lives
+        at array position (i + offset) % MAX_MUSHROOMS -- see cell()
+        -- so scrolling the rows only changes the offset.
+        """
+
+        n = MushroomField.MAX_MUSHROOMS
+        self.hp = array.array('b', [0]) * n
+        self.poisoned = array.array('b', [0]) * n
+        self.flower = array.array('b', [0]) * n
+        self.ttl = array.array('l', [0]) * n
+        self.ddt = array.array('b', [0]) * n
+        self.offset = 0
+
+        # screen position of each field index
+        self.m_pos = []
+        for i in xrange(0, n):
+            x = i % MushroomField.FIELD_WIDTH
+            y = i / MushroomField.FIELD_WIDTH
+            self.m_pos.append( pygame.Rect(
+                x * MushroomField.MUSHROOM_WIDTH,
+                y * MushroomField.MUSHROOM_HEIGHT,
+                MushroomField.MUSHROOM_WIDTH,
+                MushroomField.MUSHROOM_HEIGHT) )
+
+        """
+        row_live counts the mushrooms of each array row, every change
+        of hp goes through set_hp() which keeps it and the total of
+        the player area rows up to date. Scrolling only moves a row in
+        and a row out of the player area.
+        """
+        self.row_live = array.array('i', [0]) * MushroomField.FIELD_HEIGHT
+        self.total_player_area_mushrooms = 0
 
-        The hp also corresponds to the index of the mushroom
-        image inside of the MushroomField.images array.
         """
+        row_occupied holds a bitmask per array row of the columns with
+        a mushroom or a flower, collisions against the player and the
+        missile look up the cells they overlap in it -- see
+        span_masks(). row_poisoned mirrors the poisoned array the same
+        way, every write to it goes through set_poisoned(). The
+        Millipede steers by both.
+        """
+        self.row_occupied = array.array('l', [0]) * \
+         MushroomField.FIELD_HEIGHT
+        self.row_poisoned = array.array('l', [0]) * \
+         MushroomField.FIELD_HEIGHT
+        self.span_tables = {}
+        if MushroomField.missile_cols == None:
+            MushroomField.missile_cols = self.__missile_columns()
 
-        self.m_arr = []
-        self.m_idx = []
-        self.m_pos = []
+        """
+        Every flower is pushed on the wilting heap as (wilt time,
+        array position). Array positions do not change when the rows
+        scroll. An entry is stale when its cell no longer holds the
+        flower it was pushed for, wilt_flowers() just drops those.
+        """
+        self.wilting = []
 
-        self.total_player_area_mushrooms = 0
+        """
+        The mushrooms are drawn once onto an off-screen layer which
+        is blitted to the screen every frame. Any change to a cell
+        adds its array position to dirty and only those cells are
+        redrawn. The layer is only needed when there is a display.
+        """
+        self.dirty = set()
+        self.layer_stale = True
+        self.layer_scrolled = False
+        self.layer = None
+        if not game.headless:
+            self.layer = pygame.Surface([
+             MushroomField.FIELD_WIDTH * MushroomField.MUSHROOM_WIDTH,
+             MushroomField.FIELD_HEIGHT * MushroomField.MUSHROOM_HEIGHT])
+            self.layer = self.layer.convert()
+            self.layer.set_colorkey([0,0,0])
+
+
+    def cell(self, index):
+        """Return the array position of field index."""
+        return (index + self.offset) % MushroomField.MAX_MUSHROOMS
+
+
+    def set_hp(self, c, hp):
+        """Set the hp of array position c, counting the mushroom in or
+        out of its row."""
+        old = self.hp[c]
+        self.hp[c] = hp
+        if (old > 0) == (hp > 0):
+            return
+        self.__update_occupied(c)
+        if hp > 0:
+            inc = 1
+        else:
+            inc = -1
+        row = c / MushroomField.FIELD_WIDTH
+        self.row_live[row] += inc
+        fy = (row - (self.offset / MushroomField.FIELD_WIDTH)) % \
+         MushroomField.FIELD_HEIGHT
+        if fy >= MushroomField.FIELD_PLAYER_Y:
+            self.total_player_area_mushrooms += inc
+
+
+    def __update_occupied(self, c):
+        """Update the occupied bit of array position c."""
+        bit = 1 << (c % MushroomField.FIELD_WIDTH)
+        row = c / MushroomField.FIELD_WIDTH
+        if (self.hp[c] > 0) or self.flower[c]:
+            self.row_occupied[row] |= bit
+        else:
+            self.row_occupied[row] &= ~bit
 
-        def __new_mushroom(index):
-            """create mushroom dict entry."""
-            # need to include x and y positions for collision
-            # purposes
 
-            assert (index > -1) and \
-            (index < MushroomField.MAX_MUSHROOMS), \
-            "Index out of bounds: %d" % index
+    def set_poisoned(self, c, poisoned):
+        """Set the poisoned flag of array position c."""
+        self.poisoned[c] = poisoned
+        bit = 1 << (c % MushroomField.FIELD_WIDTH)
+        row = c / MushroomField.FIELD_WIDTH
+        if poisoned:
+            self.row_poisoned[row] |= bit
+        else:
+            self.row_poisoned[row] &= ~bit
+
+
+    def __missile_columns(self):
+        """Return, for every missile x from 0 to ARENA_W, the columns
+        the missile overlaps. When it overlaps two the one holding
+        most of it comes first."""
+        w = PlayerMissile.WIDTH
+        table = []
+        for x in xrange(0, Game.ARENA_W + 1):
+            x0 = x / MushroomField.MUSHROOM_WIDTH
+            dx = (x0 + 1) * MushroomField.MUSHROOM_WIDTH - x
+            if dx < PlayerMissile.HALF_WIDTH:
+                cols = [x0 + 1, x0]
+            else:
+                cols = [x0, x0 + 1]
+            table.append(tuple([fx for fx in cols \
+             if (fx < MushroomField.FIELD_WIDTH) and \
+             (fx * MushroomField.MUSHROOM_WIDTH < x + w)]))
+        return table
 
-            x = index % MushroomField.FIELD_WIDTH
-            y = index / MushroomField.FIELD_WIDTH
 
-            # calculate topleft x and y screen coordinates
-            topleft = ( x * MushroomField.MUSHROOM_WIDTH,
-                    y * MushroomField.MUSHROOM_WIDTH )
+    def spans(self, w, h):
+        """Return the span_masks() tables of the columns and the rows
+        a w by h rect overlaps."""
+        if (w, h) not in self.span_tables:
+            self.span_tables[(w, h)] = \
+             (span_masks(w, MushroomField.MUSHROOM_WIDTH,
+             MushroomField.FIELD_WIDTH),
+             span_masks(h, MushroomField.MUSHROOM_HEIGHT,
+             MushroomField.FIELD_HEIGHT))
+        return self.span_tables[(w, h)]
 
-            #MushroomField.images[0] = img
-            rect = pygame.Rect( 0, 0, 0, 0 )
-            rect.width = MushroomField.MUSHROOM_WIDTH
-            rect.height = MushroomField.MUSHROOM_HEIGHT
-            rect.topleft = topleft
 
-            m = { 'hp' : 0, \
-            'rect': rect, \
-            'poisoned': False, \
-            'flower': False, \
-            'ttl': 0,\
-            'ddt': False }
+    def row_of(self, fy):
+        """Return the array row of field row fy."""
+        return (fy + (self.offset / MushroomField.FIELD_WIDTH)) % \
+         MushroomField.FIELD_HEIGHT
 
-            return m
 
-        # initialize the mushroom field arrays
-        for i in xrange(0,MushroomField.MAX_MUSHROOMS):
-            m = __new_mushroom(i)
-            self.m_arr.append( m )
-            self.m_idx.append( i )
-            self.m_pos.append( m['rect'] )
+    def __occupied(self, index):
+        """True if there is a mushroom or a flower at field index."""
+        c = (index + self.offset) % MushroomField.MAX_MUSHROOMS
+        return (self.hp[c] > 0) or (self.flower[c] == 1)
 
 
     def draw(self,buffer):
         """Draw the Mushroom Field."""
-
-        for i in xrange(0,MushroomField.MAX_MUSHROOMS):
-            index = self.m_idx[i]
-            pos = self.m_pos[i]
-            m = self.m_arr[index]
-            if m['hp'] > 0:
-                if m['poisoned']:
-                    img = MushroomField.poisoned_img[m['hp']-1]
-                else:
-                    img = MushroomField.images[m['hp']-1]
-                buffer.blit( img, pos )
-            if m['flower']:
-                img = MushroomField.flower_img
-                buffer.blit( img, pos )
+        self.update_layer()
+        buffer.blit(self.layer, [0,0])
+
+
+    def draw_area(self, buffer, rect):
+        """Draw the part of the Mushroom Field inside rect."""
+        buffer.blit(self.layer, rect, rect)
+
+
+    def update_layer(self):
+        """Redraw the changed cells of the layer, return the list of
+        screen rects that changed."""
+        n = MushroomField.MAX_MUSHROOMS
+        rects = []
+        if self.layer_stale:
+            self.layer.fill([0,0,0])
+            for i in xrange(0,n):
+                self.__draw_cell(i, self.cell(i))
+            self.layer_stale = False
+            self.layer_scrolled = True
+        else:
+            for c in self.dirty:
+                i = (c - self.offset) % n
+                self.layer.fill([0,0,0], self.m_pos[i])
+                self.__draw_cell(i, c)
+                rects.append(self.m_pos[i])
+        self.dirty.clear()
+        if self.layer_scrolled:
+            self.layer_scrolled = False
+            rects = [self.layer.get_rect()]
+        return rects
+
+
+    def __draw_cell(self, index, c):
+        """Draw the mushroom or flower at field index onto the layer."""
+        pos = self.m_pos[index]
+        hp = self.hp[c]
+        if hp > 0:
+            if self.poisoned[c]:
+                img = MushroomField.poisoned_img[hp-1]
+            else:
+                img = MushroomField.images[hp-1]
+            self.layer.blit( img, pos )
+        if self.flower[c]:
+            img = MushroomField.flower_img
+            self.layer.blit( img, pos )
 
 
     def eat_mushroom(self, fx, fy):
@@ -2046,10 +3362,8 @@ class MushroomField:
             index = (fy * MushroomField.FIELD_WIDTH) + fx
             assert (index > -1) and (index < MushroomField.MAX_MUSHROOMS), \
             "Index out of bounds: %d" % index
-            m = self.m_arr[self.m_idx[index]]
-            if (m['hp'] > 0) or m['flower']:
+            if self.__occupied(index):
                 self.__reset_mushroom( index )
-                self.update_player_area_mushrooms(fy, -1)
 
 
     def mushroom_to_flower(self, fx, fy):
@@ -2063,17 +3377,20 @@ class MushroomField:
             index = (fy * MushroomField.FIELD_WIDTH) + fx
             assert (index > -1) and (index < MushroomField.MAX_MUSHROOMS), \
             "Index out of bounds: %d" % index
-            m = self.m_arr[self.m_idx[index]]
-            if m['hp'] > 0:
-                m['hp'] = 0
-                m['poisoned'] = False
-                m['flower'] = True
-                m['ttl'] = self.game.get_ticks()
-                self.update_player_area_mushrooms(fy, -1)
+            c = self.cell(index)
+            if self.hp[c] > 0:
+                self.set_hp(c, 0)
+                self.set_poisoned(c, 0)
+                self.flower[c] = 1
+                self.__update_occupied(c)
+                self.ttl[c] = self.game.get_ticks()
+                heapq.heappush(self.wilting,
+                 (self.ttl[c] + MushroomField.FLOWER_TTL, c))
+                self.dirty.add(c)
                 # do not accidentally place a flower on top of the
                 # player
                 self.clear_player_area()
-                self.game.damaged_mushrooms.append(index)
+                self.game.damaged_mushrooms.add(index)
 
     
     def poison_mushroom(self, fx, fy):
@@ -2082,33 +3399,33 @@ class MushroomField:
             index = (fy * MushroomField.FIELD_WIDTH) + fx
             assert (index > -1) and (index < MushroomField.MAX_MUSHROOMS), \
             "Index out of bounds: %d" % index
-            m = self.m_arr[self.m_idx[index]]
-            if m['hp'] > 0:
-                m['poisoned'] = True
-                if index not in self.game.damaged_mushrooms:
-                    self.game.damaged_mushrooms.append(index)
+            c = self.cell(index)
+            if self.hp[c] > 0:
+                self.set_poisoned(c, 1)
+                self.dirty.add(c)
+                self.game.damaged_mushrooms.add(index)
 
 
     def is_poisoned(self, x, y):
         """check to see if mushroom at x,y is posison."""
-        x = x / MushroomField.MUSHROOM_WIDTH
-        y = y / MushroomField.MUSHROOM_HEIGHT
-        index = ( y * MushroomField.FIELD_WIDTH ) + x
-        assert (index > -1) and \
-        (index < MushroomField.MAX_MUSHROOMS), \
-        "Index out of bounds: %d" % index
-        m = self.m_arr[self.m_idx[index]]
-        return m['poisoned']
+        fx = x / MushroomField.MUSHROOM_WIDTH
+        fy = y / MushroomField.MUSHROOM_HEIGHT
+        assert (fx > -1) and (fx < MushroomField.FIELD_WIDTH) and \
+        (fy > -1) and (fy < MushroomField.FIELD_HEIGHT), \
+        "Cell out of bounds: %d, %d" % (fx, fy)
+        return ((self.row_poisoned[self.row_of(fy)] >> fx) & 1) == 1
 
 
     def wilt_flowers(self):
-        """Remove flowers from the Mushroom Field."""
+        """Remove flowers older than FLOWER_TTL from the Mushroom Field."""
         cur_time = self.game.get_ticks()
-        for i in xrange(0, MushroomField.MAX_MUSHROOMS):
-            m = self.m_arr[self.m_idx[i]]
-            if m['flower']:
-                if (cur_time - m['ttl']) > 10000:
-                    self.__reset_mushroom( i )
+        wilting = self.wilting
+        while wilting and (wilting[0][0] < cur_time):
+            (t, c) = heapq.heappop(wilting)
+            if self.flower[c] and \
+             (self.ttl[c] + MushroomField.FLOWER_TTL == t):
+                self.__reset_mushroom((c - self.offset) % \
+                 MushroomField.MAX_MUSHROOMS)
 
 
     def populate_randomly(self):
@@ -2117,8 +3434,8 @@ class MushroomField:
 
         # populate the mushroom field with some mushrooms
         for i in xrange(MushroomField.INITIAL_MUSHROOMS):
-            fx = random.randrange(0, MushroomField.FIELD_WIDTH)
-            fy = random.randrange(0, MushroomField.FIELD_HEIGHT-1)
+            fx = self.rand.randrange(0, MushroomField.FIELD_WIDTH)
+            fy = self.rand.randrange(0, MushroomField.FIELD_HEIGHT-1)
             index = (fy * MushroomField.FIELD_WIDTH) + fx
             assert (index > -1) and \
             (index < MushroomField.MAX_MUSHROOMS), \
@@ -2135,19 +3452,17 @@ class MushroomField:
             result in incorrent mushroom counts.
             """
 
-            i = self.m_idx[index]
-            m = self.m_arr[i]
+            c = self.cell(index)
 
-            if (m['hp'] == 0) and not m['ddt']:
+            if (self.hp[c] == 0) and not self.ddt[c]:
                 self.__reset_mushroom( index )
-                m['hp'] = MushroomField.MUSHROOM_HP
-                self.update_player_area_mushrooms(fy, 1) 
+                self.set_hp(c, MushroomField.MUSHROOM_HP)
 
         # place an initial population of DDTs in the arena
         for i in range(0,Game.MAX_DDTS):
             while True:
-                fx = random.randrange(0, MushroomField.FIELD_WIDTH-1)
-                fy = random.randrange(0, MushroomField.FIELD_PLAYER_Y-1)
+                fx = self.rand.randrange(0, MushroomField.FIELD_WIDTH-1)
+                fy = self.rand.randrange(0, MushroomField.FIELD_PLAYER_Y-1)
                 #fy = MushroomField.FIELD_PLAYER_Y-1
                 if not self.__has_ddt(fx, fy):
                     self.__add_ddt(fx, fy)
@@ -2156,63 +3471,16 @@ class MushroomField:
 
     def player_collision(self,player_rect):
         """Determine if player collided with one more more Mushrooms."""
-
-        """ 
-        determine which mushrooms need to be included in the rect
-        list for colliding against the player 
-        """
-
-        x,y = player_rect.topleft
-
-        x = x / MushroomField.MUSHROOM_WIDTH
-        y = y / MushroomField.MUSHROOM_HEIGHT
-
-        m_list = []
-
-        index = (y * MushroomField.FIELD_WIDTH) + x
-        assert (index > -1) and \
-        (index < MushroomField.MAX_MUSHROOMS), \
-        "Index out of bounds: %d" % index
-        i = self.m_idx[index]
-        m = self.m_arr[i]
-        if (m['hp'] > 0) or (m['flower']):
-            m_list.append(self.m_pos[index])
-
-        x += 1
-        if x < MushroomField.FIELD_WIDTH:
-            index = (y * MushroomField.FIELD_WIDTH) + x
-            i = self.m_idx[index]
-            m = self.m_arr[i]
-            if (m['hp'] > 0) or (m['flower']):
-                m_list.append(self.m_pos[index])
-
-            y += 1
-            if y < MushroomField.FIELD_HEIGHT:
-                index = (y * MushroomField.FIELD_WIDTH) + x
-                i = self.m_idx[index]
-                m = self.m_arr[i]
-                if (m['hp'] > 0) or (m['flower']):
-                    m_list.append(self.m_pos[index])
-                x -= 1
-                index = (y * MushroomField.FIELD_WIDTH) + x
-                i = self.m_idx[index]
-                m = self.m_arr[i]
-                if (m['hp'] > 0) or (m['flower']):
-                    m_list.append(self.m_pos[index])
-        else:
-            x -= 1
-            y += 1
-            if y < MushroomField.FIELD_HEIGHT:
-                index = (y * MushroomField.FIELD_WIDTH) + x
-                i = self.m_idx[index]
-                m = self.m_arr[i]
-                if (m['hp'] > 0) or (m['flower']):
-                    m_list.append(self.m_pos[index])
-              
-        if player_rect.collidelist( m_list ) > -1:
-            return True
-        else:
-            return False
+        (x, y, w, h) = player_rect
+        (cols, rows) = self.spans(w, h)
+        cols = span_lookup(cols, x, w)
+        rows = span_lookup(rows, y, h)
+        r0 = self.offset / MushroomField.FIELD_WIDTH
+        for fy in iter_bits(rows):
+            if self.row_occupied[(fy + r0) % MushroomField.FIELD_HEIGHT] & \
+             cols:
+                return True
+        return False
 
 
     def millipede_collision(self, x, y):
@@ -2220,40 +3488,24 @@ class MushroomField:
         if (y < 0) or (y > (Game.SCREEN_H-Game.SCORE_H-1)):
             return False
         
-        x = x / MushroomField.MUSHROOM_WIDTH
-        y = y / MushroomField.MUSHROOM_HEIGHT
-
-        index = (y * MushroomField.FIELD_WIDTH) + x
-        assert (index > -1) and \
-        (index < MushroomField.MAX_MUSHROOMS), \
-        "Index out of bounds: %d" % index
-        i = self.m_idx[index]
-        m = self.m_arr[i]
-
-        return (m['hp'] > 0) or m['flower']
+        fx = x / MushroomField.MUSHROOM_WIDTH
+        fy = y / MushroomField.MUSHROOM_HEIGHT
+        assert (fx > -1) and (fx < MushroomField.FIELD_WIDTH) and \
+        (fy < MushroomField.FIELD_HEIGHT), \
+        "Cell out of bounds: %d, %d" % (fx, fy)
+        return ((self.row_occupied[self.row_of(fy)] >> fx) & 1) == 1
 
 
     def missile_collision(self, missile_rect):
         """check for Player Missle vs Mushroom collision."""
 
         """
-        this code needs to handle cases where there is
-        greater overlap between neighbors
-        could use Rect.collidelistall method 
-
-        currently this code has a preference for the left most
-        grid
+        only the row holding the top of the missile is checked, when
+        the missile overlaps two columns the one holding most of it
+        is hit first -- see __missile_columns()
         """
 
-        grids = []
-
-        x, y = missile_rect.topleft
-        
-        """
-        check neighboring cells
-        check current row left,right,center
-        and below left,right,center
-        """
+        (x, y, w, h) = missile_rect
 
         if (y < -MushroomField.MUSHROOM_HEIGHT):
             return False
@@ -2264,62 +3516,36 @@ class MushroomField:
         # first row -- clamp y grid value since we can go into y<0
         else:
             y0 = 0
+            # still above the field
+            if y + h <= 0:
+                return False
 
-        x0 = x / MushroomField.MUSHROOM_WIDTH
-
-        # far right -- only need to consider 1 grid
-        if (x > Game.ARENA_W):
-            grids.append( (x0, y0) )
-        else:
-            # determine which grid must be checked first
-            # the current one or the one to the right?
-
-            index = ( y0 * MushroomField.FIELD_WIDTH ) + x0
-            assert (index > -1) and \
-            (index < MushroomField.MAX_MUSHROOMS), \
-            "Index out of bounds: %d" % index
-            i = self.m_idx[index]
-            m = self.m_arr[i]
-            #(tmp_x, tmp_y) = m['rect'].topleft
-            (tmp_x, tmp_y) = self.m_pos[index].topleft
-            dx = tmp_x + MushroomField.MUSHROOM_WIDTH - x
-            # right grid first
-            if dx < PlayerMissile.HALF_WIDTH:
-                grids.append( (x0+1, y0) )
-                grids.append( (x0, y0) )
-            # left grid first
-            else:
-                grids.append( (x0, y0) )
-                grids.append( (x0+1, y0) )
+        occupied = self.row_occupied[self.row_of(y0)]
+        if not occupied:
+            return False
 
-        missile_hit = False
-        m_rect = pygame.Rect(0, 0, \
-                MushroomField.MUSHROOM_WIDTH, \
-                MushroomField.MUSHROOM_HEIGHT)
+        # off either side
+        if x <= -w:
+            return False
+        elif x < 0:
+            x = 0
+        elif x > Game.ARENA_W:
+            x = Game.ARENA_W
 
-        for fx,fy in grids:
-            index = ( fy * MushroomField.FIELD_WIDTH ) + fx
-            assert (index > -1) and \
-            (index < MushroomField.MAX_MUSHROOMS), \
-            "Index out of bounds: %d" % index
-            i = self.m_idx[index]
-            m = self.m_arr[i]
-            #m_rect.topleft = m['rect'].topleft
-            m_rect.topleft = self.m_pos[index].topleft
-            if (m['hp'] > 0) or m['flower']:
-                if m_rect.colliderect(missile_rect):
-                    missile_hit = True
-                    if index not in self.game.damaged_mushrooms:
-                        self.game.damaged_mushrooms.append(index)
-                    if m['flower'] == False:
-                        m['hp'] -= 1
-                        if m['hp'] == 0:
-                            self.game.score += \
-                                    MushroomField.MUSHROOM_POINTS
-                            self.update_player_area_mushrooms(fy, -1)
-                    break
+        for fx in MushroomField.missile_cols[x]:
+            if (occupied >> fx) & 1:
+                index = ( y0 * MushroomField.FIELD_WIDTH ) + fx
+                c = self.cell(index)
+                self.game.damaged_mushrooms.add(index)
+                if not self.flower[c]:
+                    self.set_hp(c, self.hp[c] - 1)
+                    self.dirty.add(c)
+                    if self.hp[c] == 0:
+                        self.game.score += \
+                                MushroomField.MUSHROOM_POINTS
+                return True
 
-        return missile_hit
+        return False
 
 
     def add_mushroom(self, fx=-1, fy=-1, index=-1):
@@ -2336,11 +3562,10 @@ class MushroomField:
         assert (index > -1) and\
         (index < MushroomField.MAX_MUSHROOMS), \
         "Index out of bounds: %d" % index
-        i = self.m_idx[index]
-        m = self.m_arr[i]
+        c = self.cell(index)
 
         # do not allow mushroom to appear on top of a DDT
-        if m['ddt']:
+        if self.ddt[c]:
             return
 
         # do not allow mushroom to appear on top of the player
@@ -2352,10 +3577,9 @@ class MushroomField:
             return
 
         # place a mushroom only if one does not already exist
-        if m['hp'] == 0:
+        if self.hp[c] == 0:
             self.__reset_mushroom( index )
-            m['hp'] = MushroomField.MUSHROOM_HP
-            self.update_player_area_mushrooms(fy,1)
+            self.set_hp(c, MushroomField.MUSHROOM_HP)
 
 
     def __add_ddt(self, fx, fy):
@@ -2376,13 +3600,11 @@ class MushroomField:
         if DEBUG:
             print "ADD DDT: ", index, fx, fy
         ddt.add(self.game.ddts)
-        i = self.m_idx[index]
-        j = self.m_idx[index+1]
         # a ddt takes up 2 squares, but we only want to keep
         # one reference otherwise a row shift would result
         # in the ddt going up twice
-        self.m_arr[i]['ddt'] = True
-        self.m_arr[j]['ddt'] = True
+        self.ddt[self.cell(index)] = 1
+        self.ddt[self.cell(index+1)] = 1
 
 
     def remove_ddt(self, fx, fy):
@@ -2402,49 +3624,63 @@ class MushroomField:
         assert (index > -1) and \
         (index < MushroomField.MAX_MUSHROOMS), \
         "Index out of bounds: %d" % index
-        m0 = self.m_arr[self.m_idx[index]]
-        m1 = self.m_arr[self.m_idx[index+1]]
-        return (m0['ddt'] or m1['ddt'])
-
-
-    def update_player_area_mushrooms(self, fy=-1, inc=0):
-        """keep track of num mushrooms in player area."""
-        # handle row down or up, just do a total count
-        # once row change has taken place
-        if inc == 0:
-            self.total_player_area_mushrooms = 0
-            for fy in xrange(MushroomField.FIELD_PLAYER_Y,
-                    MushroomField.FIELD_HEIGHT):
-                for fx in xrange(0, MushroomField.FIELD_WIDTH):
-                    index = (MushroomField.FIELD_WIDTH * fy) + fx
-
-                    assert (index > -1) and \
-                    (index < MushroomField.MAX_MUSHROOMS), \
-                    "Index out of bounds: %d" % index
-
-                    m = self.m_arr[self.m_idx[index]]
-                    if m['hp'] > 0:
-                        self.total_player_area_mushrooms += 1
-        # handle all other cases
-        else:
+        return (self.ddt[self.cell(index)] or self.ddt[self.cell(index+1)])
+
+
+    def check_player_area_mushrooms(self):
+        """With CHECK_COUNTS set, check the mushroom counts against a
+        full rescan of the field, and the occupied and poisoned masks
+        with them."""
+        if not MushroomField.CHECK_COUNTS:
+            return
+        total = 0
+        for fy in xrange(0, MushroomField.FIELD_HEIGHT):
+            n = 0
+            mask = 0
+            poisoned = 0
+            for fx in xrange(0, MushroomField.FIELD_WIDTH):
+                index = (MushroomField.FIELD_WIDTH * fy) + fx
+                if self.hp[self.cell(index)] > 0:
+                    n += 1
+                if self.__occupied(index):
+                    mask |= 1 << fx
+                if self.poisoned[self.cell(index)]:
+                    poisoned |= 1 << fx
+            assert self.row_occupied[self.row_of(fy)] == mask, \
+            "Row %d occupied mask is %x, counted %x" % \
+            (fy, self.row_occupied[self.row_of(fy)], mask)
+            assert self.row_poisoned[self.row_of(fy)] == poisoned, \
+            "Row %d poisoned mask is %x, counted %x" % \
+            (fy, self.row_poisoned[self.row_of(fy)], poisoned)
+            assert self.row_live[self.row_of(fy)] == n, \
+            "Row %d holds %d mushrooms, counted %d" % \
+            (fy, self.row_live[self.row_of(fy)], n)
             if fy >= MushroomField.FIELD_PLAYER_Y:
-                self.total_player_area_mushrooms += inc
+                total += n
+        assert self.total_player_area_mushrooms == total, \
+        "Player area holds %d mushrooms, counted %d" % \
+        (self.total_player_area_mushrooms, total)
 
 
     def row_up(self):
         """move field row up and clear the last row."""
-        # shift the rows up
-        if DEBUG:
-            print self.m_idx
-        n = MushroomField.FIELD_WIDTH
-        m = MushroomField.MAX_MUSHROOMS
-        first_row = self.m_idx[0:n]
-        self.m_idx = self.m_idx[n:m] + first_row
+        # the top row of the player area moves out of it and the top
+        # row, about to be cleared, moves into it as the bottom row
+        self.total_player_area_mushrooms += \
+         self.row_live[self.row_of(0)] - \
+         self.row_live[self.row_of(MushroomField.FIELD_PLAYER_Y)]
+        # shift the rows up, the old top row becomes the bottom row
+        self.offset = (self.offset + MushroomField.FIELD_WIDTH) % \
+         MushroomField.MAX_MUSHROOMS
         if DEBUG:
-            print self.m_idx
+            print "ROW UP offset: ", self.offset
+        if self.layer:
+            self.layer.scroll(0, -MushroomField.MUSHROOM_HEIGHT)
+            self.layer_scrolled = True
         
         # reset bottom-row of mushrooms
         n = MushroomField.MAX_MUSHROOMS - MushroomField.FIELD_WIDTH
+        m = MushroomField.MAX_MUSHROOMS
         for i in range(n,m):
             self.__reset_mushroom(i)
        
@@ -2453,19 +3689,25 @@ class MushroomField:
         for d in self.game.ddts:
             d.update_position(MushroomField.MOVE_ROW_UP)
         self.clear_player_area()
-        self.update_player_area_mushrooms()
-        self.__update_damaged_mushrooms(-MushroomField.FIELD_WIDTH)
+        self.check_player_area_mushrooms()
+        self.game.damaged_mushrooms.shift(-MushroomField.FIELD_WIDTH)
  
 
     def row_down(self):
         """move field row down and spawn a new row of fresh 
         mushrooms and ddts.""" 
  
-        # shift the rows down
-        n = MushroomField.MAX_MUSHROOMS - MushroomField.FIELD_WIDTH
-        m = MushroomField.MAX_MUSHROOMS
-        last_row = self.m_idx[n:m]
-        self.m_idx = last_row + self.m_idx[0:n]
+        # the bottom row, about to be cleared as the top row, moves out
+        # of the player area and the row above it moves in
+        self.total_player_area_mushrooms += \
+         self.row_live[self.row_of(MushroomField.FIELD_PLAYER_Y-1)] - \
+         self.row_live[self.row_of(MushroomField.FIELD_HEIGHT-1)]
+        # shift the rows down, the old bottom row becomes the top row
+        self.offset = (self.offset - MushroomField.FIELD_WIDTH) % \
+         MushroomField.MAX_MUSHROOMS
+        if self.layer:
+            self.layer.scroll(0, MushroomField.MUSHROOM_HEIGHT)
+            self.layer_scrolled = True
 
         # reset top-row of mushrooms
         for i in range(0,MushroomField.FIELD_WIDTH):
@@ -2479,8 +3721,7 @@ class MushroomField:
             if DEBUG:
                 print "CLEAR DDTs ", start, end
             for i in xrange(start, end):
-                ddt = self.m_arr[self.m_idx[i]]['ddt']
-                if ddt:
+                if self.ddt[self.cell(i)]:
                     if DEBUG:
                         print "REMOVING DDT in PLayer Area"
                     self.__reset_mushroom(i)
@@ -2490,9 +3731,9 @@ class MushroomField:
             """spawn a new row of mushrooms and ddts."""
 
             # generate n number of mushrooms
-            n = random.randrange(0,MushroomField.MUSHROOM_WIDTH)
+            n = self.rand.randrange(0,MushroomField.MUSHROOM_WIDTH)
             for i in range(n):
-                x = random.randrange(0,MushroomField.FIELD_WIDTH)
+                x = self.rand.randrange(0,MushroomField.FIELD_WIDTH)
                 self.add_mushroom(x, 0)
 
             n = len(self.game.ddts)
@@ -2500,14 +3741,14 @@ class MushroomField:
                 print "num ddts ", n
             if n < Game.MAX_DDTS:
                 chance = (4-n) * 25
-                r = random.randrange(0,100)
+                r = self.rand.randrange(0,100)
                 # 25% chance to spawn a DDT
                 if DEBUG:
                     print chance, r
                 if r <= chance:
                     if DEBUG:
                         print "DDT spawned"
-                    x = random.randrange(0,MushroomField.FIELD_WIDTH-1)
+                    x = self.rand.randrange(0,MushroomField.FIELD_WIDTH-1)
                     self.__add_ddt(x, 0)
             n = len(self.game.ddts)
             if DEBUG:
@@ -2517,68 +3758,46 @@ class MushroomField:
         for d in self.game.ddts:
             d.update_position(MushroomField.MOVE_ROW_DOWN)
         self.clear_player_area()
-        self.update_player_area_mushrooms()
         # bring in a new row of mushrooms and ddts
         __clear_ddts()
         __row_spawn()
-        self.__update_damaged_mushrooms(MushroomField.FIELD_WIDTH)
+        self.check_player_area_mushrooms()
+        self.game.damaged_mushrooms.shift(MushroomField.FIELD_WIDTH)
 
         
-    def __update_damaged_mushrooms(self, dy):
-        """ updated damaged mushrooms list """
-        n = len(self.game.damaged_mushrooms)
-        m = 0
-        for i in xrange(0,n):
-            if DEBUG:
-                print i, n
-                print self.game.damaged_mushrooms[i]
-            self.game.damaged_mushrooms[i] += dy
-            if (self.game.damaged_mushrooms[i] > \
-                (MushroomField.MAX_MUSHROOMS-1)) or \
-                (self.game.damaged_mushrooms[i] < 0):
-                self.game.damaged_mushrooms[i] = -1
-                m += 1
-
-        """ clear any mushrooms which have scrolled off the field """
-        for i in xrange(0,m):
-                if DEBUG:
-                    print "Update Damaged Mushroom List: ", i
-                self.game.damaged_mushrooms.remove(-1)
-
-        if DEBUG:
-            print "DAMAGED MUSHROOMS LIST"
-            print self.game.damaged_mushrooms
-
-
     def __reset_mushroom(self, index):
         """reset mushroom grid entry."""
 
         assert (index > -1) and \
         (index < MushroomField.MAX_MUSHROOMS), \
         "Index out of bounds: %d" % index
-        i = self.m_idx[index]
-        self.m_arr[i]['hp'] = 0
-        self.m_arr[i]['poisoned'] = False
-        self.m_arr[i]['flower'] = False
-        self.m_arr[i]['ttl'] = False
-        self.m_arr[i]['ddt'] = False
+        c = self.cell(index)
+        self.set_hp(c, 0)
+        self.set_poisoned(c, 0)
+        self.flower[c] = 0
+        self.ttl[c] = 0
+        self.ddt[c] = 0
+        self.__update_occupied(c)
+        self.dirty.add(c)
 
 
     def reset(self):
         """Clear the MushroomField."""
         # pick starting color
         n = len(MushroomField.colors)
-        self.cur_color_idx = random.randrange(0,n)
+        self.cur_color_idx = self.rand.randrange(0,n)
         self.cur_color = MushroomField.colors[self.cur_color_idx]
         for i in range(0,4):
            img = MushroomField.images[i]
            img.fill([0,0,0])
            img.fill(self.cur_color[i], self.tmp_rect)
+        self.layer_stale = True
  
         # clear the field
         for i in xrange(0, MushroomField.MAX_MUSHROOMS):
             self.__reset_mushroom(i)
             self.game.ddts.empty()
+        self.wilting = []
 
 
     def restore_mushroom(self, index):
@@ -2588,28 +3807,29 @@ class MushroomField:
         (index < MushroomField.MAX_MUSHROOMS), \
         "Index out of bounds: %d" % index
 
-        i = self.m_idx[index]
+        c = self.cell(index)
 
         restore = False
 
-        if self.m_arr[i]['flower']:
+        if self.flower[c]:
             fx = index % MushroomField.FIELD_WIDTH
             fy = index / MushroomField.FIELD_WIDTH
             self.__reset_mushroom(index)
             self.add_mushroom(fx, fy)
-            self.update_player_area_mushrooms()
+            self.check_player_area_mushrooms()
             restore = True
             if DEBUG:
                 print "FLOWER RESTORED"
 
-        #elif (self.m_arr[i]['hp'] > 0) and \
-        #    (self.m_arr[i]['hp'] < MushroomField.MUSHROOM_HP):
-        elif self.m_arr[i]['hp'] > 0:
-            self.m_arr[i]['hp'] = MushroomField.MUSHROOM_HP
-            self.m_arr[i]['poisoned'] = False
+        #elif (self.hp[c] > 0) and \
+        #    (self.hp[c] < MushroomField.MUSHROOM_HP):
+        elif self.hp[c] > 0:
+            self.set_hp(c, MushroomField.MUSHROOM_HP)
+            self.set_poisoned(c, 0)
+            self.dirty.add(c)
             restore = True
             if DEBUG:
-                print "DAMAGED MUSHROOM RESTORED: %d " % self.m_arr[i]['hp']
+                print "DAMAGED MUSHROOM RESTORED: %d " % self.hp[c]
                 print MushroomField.MUSHROOM_HP
 
         if restore:
@@ -2639,73 +3859,13 @@ class MushroomField:
         """ now remove any mushrooms which may have collided
         or been placed ontop of the player. """
 
-        x, y = self.game.player.rect.topleft
-        fx = x / MushroomField.MUSHROOM_WIDTH
-        fy = y / MushroomField.MUSHROOM_HEIGHT
-
-        m_list = []
-
-        index = (fy * MushroomField.FIELD_WIDTH) + fx
-        assert (index > -1) and \
-        (index < MushroomField.MAX_MUSHROOMS), \
-        "Index out of bounds: %d" % index
-
-        i = self.m_idx[index]
-
-        m = self.m_arr[i]
-        if (m['hp'] > 0) or (m['flower']):
-            m_list.append(index)
-
-        fx += 1
-        if fx < MushroomField.FIELD_WIDTH:
-            index = (fy * MushroomField.FIELD_WIDTH) + fx
-            assert (index > -1) and \
-            (index < MushroomField.MAX_MUSHROOMS), \
-            "Index out of bounds: %d" % index
-            i = self.m_idx[index]
-            m = self.m_arr[i]
-            if (m['hp'] > 0) or (m['flower']):
-                m_list.append(index)
-
-            fy += 1
-            if fy < MushroomField.FIELD_HEIGHT:
-                index = (fy * MushroomField.FIELD_WIDTH) + fx
-                assert (index > -1) and \
-                (index < MushroomField.MAX_MUSHROOMS), \
-                "Index out of bounds: %d" % index 
-                i = self.m_idx[index]
-                m = self.m_arr[i]
-                if (m['hp'] > 0) or (m['flower']):
-                    m_list.append(index)
-                fx -= 1
-                index = (fy * MushroomField.FIELD_WIDTH) + fx
-                i = self.m_idx[index]
-                m = self.m_arr[i]
-                if (m['hp'] > 0) or (m['flower']):
-                    m_list.append(index)
-        else:
-            fx -= 1
-            fy += 1
-            if fy < MushroomField.FIELD_HEIGHT:
-                index = (fy * MushroomField.FIELD_WIDTH) + fx
-                assert (index > -1) and \
-                (index < MushroomField.MAX_MUSHROOMS), \
-                "Index out of bounds: %d" % index 
-                i = self.m_idx[index]
-                m = self.m_arr[i]
-                if (m['hp'] > 0) or (m['flower']):
-                    m_list.append(index)
-              
-        for i in m_list:
-            m = self.m_arr[i]
-            if self.game.player.rect.colliderect(m['rect']):
-                fx = i % MushroomField.FIELD_WIDTH
-                fy = i / MushroomField.FIELD_WIDTH
-                # remember my friends, flowers do not count as
-                # mushroom!
-                if not m['flower']:
-                    self.update_player_area_mushrooms( fy, -1 )
-                self.__reset_mushroom(i)
+        (x, y, w, h) = self.game.player.rect
+        (cols, rows) = self.spans(w, h)
+        cols = span_lookup(cols, x, w)
+        rows = span_lookup(rows, y, h)
+        for fy in iter_bits(rows):
+            for fx in iter_bits(self.row_occupied[self.row_of(fy)] & cols):
+                self.__reset_mushroom((fy * MushroomField.FIELD_WIDTH) + fx)
 
 
     def change_color(self):
@@ -2719,8 +3879,20 @@ class MushroomField:
            img = MushroomField.images[i]
            img.fill([0,0,0])
            img.fill(self.cur_color[i], self.tmp_rect)
+        self.layer_stale = True
  
 
+    def bitboard(self, values):
+        """Return field attribute array values as an integer with bit i
+        set when field index i is non-zero."""
+        # rotate the array into field order, then let int() do the
+        # per cell work -- bit i is character i of the reversed string
+        s = values.tostring().translate(MushroomField.BIT_TABLE)
+        c = self.offset
+        s = s[c:] + s[:c]
+        return int(s[::-1], 2)
+
+
     def birth_and_death(self):
         """Mushroom Field Birth and Death."""
 
@@ -2740,6 +3912,54 @@ class MushroomField:
         4. Any dead cell with exactly three live neighbors comes to
         life.
 
+        The whole field is stepped at once on bitboards, see
+        life_step(). Only the cells that change are touched.
+        """
+
+        ddt = self.bitboard(self.ddt)
+        live = self.bitboard(self.hp) & ~ddt
+
+        next_gen = life_step(live, MushroomField.FIELD_WIDTH,
+         MushroomField.FIELD_HEIGHT)
+
+        # last row is always empty and mushrooms never grow on a DDT
+        mask = MushroomField.LIFE_MASK & ~ddt
+
+        for i in iter_bits(live & ~next_gen & mask):
+            self.__reset_mushroom(i)
+
+        # add_mushroom keeps mushrooms off the player
+        for i in iter_bits(next_gen & ~live & mask):
+            self.add_mushroom(index=i)
+
+        self.check_player_area_mushrooms()
+
+
+    def birth_and_death_scan(self):
+        """Mushroom Field Birth and Death, one cell at a time.
+
+        This is the original per cell loop. It is kept as the reference
+        implementation that bench.py measures birth_and_death against.
+        Unlike birth_and_death it updates the field in place, so a cell
+        sees the births and deaths of the cells scanned before it.
+        """
+
+        """
+        From wikipedia:
+
+        Conway's Game of Life Rules
+
+        For each cell apply the following rules:
+
+        1. Any live cell with fewer than two live neighbors dies, as
+        if by loneliness.
+        2. Any live cell with more than three live neighbors dies, as
+        if by overcrowding.
+        3. Any live cell with two or three live neighbors lives,
+        unchanged, to the next generation.
+        4. Any dead cell with exactly three live neighbors comes to
+        life.
+
         """
 
         cells = [-1, -1, -1, -1, -1, -1, -1, -1]
@@ -2749,49 +3969,200 @@ class MushroomField:
 
         for i in xrange(0,n):
             if i == 0:
-                cells[0] = self.m_idx[i+1]
-                cells[1] = self.m_idx[i+MushroomField.FIELD_WIDTH]
-                cells[2] = self.m_idx[i+MushroomField.FIELD_WIDTH+1]
+                cells[0] = self.cell(i+1)
+                cells[1] = self.cell(i+MushroomField.FIELD_WIDTH)
+                cells[2] = self.cell(i+MushroomField.FIELD_WIDTH+1)
                 count = 3
             elif i < MushroomField.FIELD_WIDTH:
-                cells[0] = self.m_idx[i-1]
-                cells[1] = self.m_idx[i+1]
-                cells[2] = self.m_idx[i+MushroomField.FIELD_WIDTH-1]
-                cells[3] = self.m_idx[i+MushroomField.FIELD_WIDTH]
-                cells[4] = self.m_idx[i+MushroomField.FIELD_WIDTH+1]
+                cells[0] = self.cell(i-1)
+                cells[1] = self.cell(i+1)
+                cells[2] = self.cell(i+MushroomField.FIELD_WIDTH-1)
+                cells[3] = self.cell(i+MushroomField.FIELD_WIDTH)
+                cells[4] = self.cell(i+MushroomField.FIELD_WIDTH+1)
                 count = 5 
             else:
-                cells[0] = self.m_idx[i-1-MushroomField.FIELD_WIDTH]
-                cells[1] = self.m_idx[i-MushroomField.FIELD_WIDTH]
-                cells[2] = self.m_idx[i-MushroomField.FIELD_WIDTH+1]
-                cells[3] = self.m_idx[i-1]
-                cells[4] = self.m_idx[i+1]
-                cells[5] = self.m_idx[i+MushroomField.FIELD_WIDTH-1]
-                cells[6] = self.m_idx[i+MushroomField.FIELD_WIDTH]
-                cells[7] = self.m_idx[i+MushroomField.FIELD_WIDTH+1]
+                cells[0] = self.cell(i-1-MushroomField.FIELD_WIDTH)
+                cells[1] = self.cell(i-MushroomField.FIELD_WIDTH)
+                cells[2] = self.cell(i-MushroomField.FIELD_WIDTH+1)
+                cells[3] = self.cell(i-1)
+                cells[4] = self.cell(i+1)
+                cells[5] = self.cell(i+MushroomField.FIELD_WIDTH-1)
+                cells[6] = self.cell(i+MushroomField.FIELD_WIDTH)
+                cells[7] = self.cell(i+MushroomField.FIELD_WIDTH+1)
                 count = 8
 
             neighbors = 0
             for j in range(0,count):
-                m = self.m_arr[cells[j]]
-                if (m['hp'] > 0) and not m['ddt']:
+                c = cells[j]
+                if (self.hp[c] > 0) and not self.ddt[c]:
                     neighbors += 1
 
             if DEBUG:
                 print "neighbors: ", neighbors
 
-            m = self.m_arr[self.m_idx[i]]
+            c = self.cell(i)
             if DEBUG:
-                print m['hp']
+                print self.hp[c]
             # mushroom dies
-            if m['hp'] and not m['ddt']:
+            if self.hp[c] and not self.ddt[c]:
                 if (neighbors < 2) or (neighbors > 3):
                    self.__reset_mushroom(i)
             # mushroom regrows
-            elif not m['ddt'] and (neighbors==3):
+            elif not self.ddt[c] and (neighbors==3):
                 self.add_mushroom(index=i) 
             
-        self.update_player_area_mushrooms()
+        self.check_player_area_mushrooms()
+
+#####################################################################
+
+
+"""
+Game of Life on bitboards. A board is a (long) integer holding one bit
+per cell of a width x height grid, bit (y * width) + x for cell x,y.
+Python does the shifts and masks of a whole board in C, so a step costs
+a couple of dozen big integer operations no matter how large the grid.
+"""
+
+span_tables = {}
+
+def span_masks(length, cell, cells):
+    """Return the table of the cells a span of length pixels overlaps
+    on a line of cells cells, each cell pixels long.
+
+    Entry p + length is the bitmask of the cells overlapped by the
+    span starting at pixel p, for p from -length to cell * cells.
+    Spans starting further out overlap nothing, like those two ends.
+    """
+    key = (length, cell, cells)
+    if key not in span_tables:
+        end = cell * cells
+        table = []
+        for p in xrange(-length, end + 1):
+            mask = 0
+            for i in xrange(max(p, 0) / cell,
+             (min(p + length, end) + cell - 1) / cell):
+                mask |= 1 << i
+            table.append(mask)
+        span_tables[key] = table
+    return span_tables[key]
+
+
+def span_lookup(table, p, length):
+    """Return the entry of a span_masks() table for pixel p."""
+    if p < -length:
+        p = -length
+    elif p >= len(table) - length:
+        p = len(table) - length - 1
+    return table[p + length]
+
+
+life_masks = {}
+
+def life_column_masks(width, height):
+    """Return the (not first column, not last column, all cells) masks
+    of a width x height board."""
+    key = (width, height)
+    if key not in life_masks:
+        first = 0
+        for y in xrange(0, height):
+            first |= 1 << (y * width)
+        full = (1 << (width * height)) - 1
+        last = first << (width - 1)
+        life_masks[key] = (full ^ first, full ^ last, full)
+    return life_masks[key]
+
+
+def life_step(live, width, height):
+    """Return the next Game of Life generation of board live.
+
+    Cells outside of the board are dead, the board does not wrap.
+    """
+    not_first, not_last, full = life_column_masks(width, height)
+
+    # bit i of each neighbor board is set when that neighbor of cell i
+    # is alive
+    west = (live << 1) & not_first
+    east = (live >> 1) & not_last
+    neighbors = (west, east,
+     (live << width) & full, live >> width,
+     (west << width) & full, west >> width,
+     (east << width) & full, east >> width)
+
+    # bit sliced counter: count = s0 + 2*s1 + 4*s2 per cell. eight
+    # neighbors wrap around to zero, which is just as dead.
+    s0 = s1 = s2 = 0
+    for n in neighbors:
+        c0 = s0 & n
+        s0 ^= n
+        c1 = s1 & c0
+        s1 ^= c0
+        s2 ^= c1
+
+    two_or_three = s1 & ~s2
+    return two_or_three & (s0 | live)
+
+
+def iter_bits(board):
+    """Yield the index of each set bit of board, lowest first."""
+    while board:
+        low = board & -board
+        yield low.bit_length() - 1
+        board ^= low
+
+
+class CellSet:
+    """A set of MushroomField cell indexes kept as the bits of an int.
+
+    Scrolling the field a row shifts the whole set at once, cells
+    scrolled off the field drop out. pop() hands out the cells from
+    the bottom right of the field up, always in the same order.
+    """
+
+    def __init__(self, size):
+        self.mask = (1 << size) - 1
+        self.bits = 0
+
+
+    def add(self, index):
+        self.bits |= 1 << index
+
+
+    def __contains__(self, index):
+        return (self.bits >> index) & 1 == 1
+
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+
+    def __nonzero__(self):
+        return self.bits != 0
+
+
+    def __iter__(self):
+        return iter_bits(self.bits)
+
+
+    def pop(self):
+        """Remove and return the highest cell index."""
+        index = self.bits.bit_length() - 1
+        if index < 0:
+            raise KeyError('pop from an empty CellSet')
+        self.bits ^= 1 << index
+        return index
+
+
+    def clear(self):
+        self.bits = 0
+
+
+    def shift(self, n):
+        """Add n to every cell index, dropping those off the field."""
+        if n >= 0:
+            self.bits = (self.bits << n) & self.mask
+        else:
+            self.bits >>= -n
+
 
 #####################################################################
 
@@ -2815,6 +4186,7 @@ class Bee(pygame.sprite.Sprite):
 
     def __init__(self, game):
         self.game = game
+        self.rand = game.random_stream('bee')
         pygame.sprite.Sprite.__init__(self)
 
         if Bee.frames == None:
@@ -2830,7 +4202,7 @@ class Bee(pygame.sprite.Sprite):
         self.cur_frame = 0
         #self.rect = self.image.get_rect()
 
-        start_x = (random.randrange(0,Game.SCREEN_W-1) / Bee.WIDTH) * Bee.WIDTH
+        start_x = (self.rand.randrange(0,Game.SCREEN_W-1) / Bee.WIDTH) * Bee.WIDTH
         self.hp = Bee.HP
         self.dy = Bee.y_inc_slow
         self.column = start_x / MushroomField.MUSHROOM_WIDTH
@@ -2841,7 +4213,7 @@ class Bee(pygame.sprite.Sprite):
         however if the program ever goes into an infite
         loop this will be the first place to look! 
         """
-        start_x = (random.randrange(0,Game.SCREEN_W-1) / Bee.WIDTH) * Bee.WIDTH
+        start_x = (self.rand.randrange(0,Game.SCREEN_W-1) / Bee.WIDTH) * Bee.WIDTH
         self.column = start_x / MushroomField.MUSHROOM_WIDTH
         self.rect = pygame.Rect( start_x, 0, Bee.WIDTH, Bee.HEIGHT )
     
@@ -2859,7 +4231,7 @@ class Bee(pygame.sprite.Sprite):
 
         gx = self.rect.left / MushroomField.MUSHROOM_WIDTH
         gy = self.rect.top / MushroomField.MUSHROOM_HEIGHT
-        n = random.randrange(0,100)
+        n = self.rand.randrange(0,100)
         if self.rect.top < (Game.SCREEN_H - Game.SCORE_H):
             """ need better way of doing this ... """
 
@@ -2928,6 +4300,7 @@ class Earwig(pygame.sprite.Sprite):
 
     def __init__(self, game):
         self.game = game
+        self.rand = game.random_stream('earwig')
         pygame.sprite.Sprite.__init__(self)
 
         if Earwig.l_frames == None:
@@ -2941,7 +4314,7 @@ class Earwig(pygame.sprite.Sprite):
             Earwig.HEIGHT = Earwig.l_frames[0].get_height()
             Earwig.WIDTH = Earwig.l_frames[0].get_width()
 
-        n = self.game.rng(0,100)
+        n = self.rand.randint(0,100)
         if n < 50:
             start_x = 0 - Earwig.WIDTH
             self.image = Earwig.r_frames[0]
@@ -2951,7 +4324,7 @@ class Earwig(pygame.sprite.Sprite):
             self.image = Earwig.l_frames[0]
             self.dx = Earwig.X_LEFT_INC 
         
-        start_y = (random.randrange(0,Game.ARENA_H-Game.PLAYER_H) / \
+        start_y = (self.rand.randrange(0,Game.ARENA_H-Game.PLAYER_H) / \
         MushroomField.MUSHROOM_HEIGHT) * MushroomField.MUSHROOM_HEIGHT
         self.rect = pygame.Rect( start_x, start_y, \
         Earwig.WIDTH, Earwig.HEIGHT )
@@ -3013,6 +4386,7 @@ class Inchworm(pygame.sprite.Sprite):
 
     def __init__(self, game):
         self.game = game
+        self.rand = game.random_stream('inchworm')
         pygame.sprite.Sprite.__init__(self)
 
         if Inchworm.frames == None:
@@ -3027,10 +4401,10 @@ class Inchworm(pygame.sprite.Sprite):
         self.frame_delay = self.game.get_ticks()
         self.cur_frame = 0
         
-        y = random.randrange(0, MushroomField.FIELD_PLAYER_Y)
+        y = self.rand.randrange(0, MushroomField.FIELD_PLAYER_Y)
         start_y = y * MushroomField.MUSHROOM_HEIGHT
 
-        n = self.game.rng(0,100)
+        n = self.rand.randint(0,100)
         if n < 50:
             start_x = Game.SCREEN_W
             self.dx = Inchworm.X_INC
@@ -3097,6 +4471,7 @@ class Beetle(pygame.sprite.Sprite):
 
     def __init__(self, game):
         self.game = game
+        self.rand = game.random_stream('beetle')
         pygame.sprite.Sprite.__init__(self)
         if Beetle.frames == None:
             Beetle.frames = []
@@ -3112,21 +4487,21 @@ class Beetle(pygame.sprite.Sprite):
         self.frame_delay = self.game.get_ticks()
         self.cur_frame = 0
         
-        n = random.randrange(0,10)
+        n = self.rand.randrange(0,10)
 
         if (n % 2):
             start_x = -Beetle.WIDTH
         else:
             start_x = Game.SCREEN_W
 
-        y = random.randrange(Game.ARENA_H-Game.PLAYER_H, \
+        y = self.rand.randrange(Game.ARENA_H-Game.PLAYER_H, \
         (Game.ARENA_H - Beetle.HEIGHT), Beetle.HEIGHT)
 
         self.rect = pygame.Rect( start_x, y, Beetle.WIDTH, Beetle.HEIGHT )
 
-        self.dest_x = random.randrange(0,\
+        self.dest_x = self.rand.randrange(0,\
         MushroomField.FIELD_WIDTH-1) * MushroomField.MUSHROOM_WIDTH
-        self.dest_y = random.randrange(MushroomField.FIELD_HEIGHT/2,\
+        self.dest_y = self.rand.randrange(MushroomField.FIELD_HEIGHT/2,\
         MushroomField.FIELD_PLAYER_Y) * MushroomField.MUSHROOM_HEIGHT
 
         if self.dest_x == 0:
@@ -3252,6 +4627,7 @@ class Dragonfly(pygame.sprite.Sprite):
 
     def __init__(self, game):
         self.game = game
+        self.rand = game.random_stream('dragonfly')
         pygame.sprite.Sprite.__init__(self)
 
         if Dragonfly.frames == None:
@@ -3267,7 +4643,7 @@ class Dragonfly(pygame.sprite.Sprite):
         self.cur_frame = 0
         self.frame_delay = self.game.get_ticks()
         
-        start_x = (random.randrange(0,Game.SCREEN_W-1) / \
+        start_x = (self.rand.randrange(0,Game.SCREEN_W-1) / \
         MushroomField.MUSHROOM_WIDTH) * MushroomField.MUSHROOM_WIDTH
         self.rect = pygame.Rect( start_x, 0, Dragonfly.WIDTH, \
         Dragonfly.HEIGHT )
@@ -3275,7 +4651,7 @@ class Dragonfly(pygame.sprite.Sprite):
         self.dx = Dragonfly.x_inc
         self.dy = Dragonfly.y_inc
         
-        n = random.randrange(0,10)
+        n = self.rand.randrange(0,10)
         if n < 5:
             self.dx = -self.dx
     
@@ -3291,7 +4667,7 @@ class Dragonfly(pygame.sprite.Sprite):
             self.image = Dragonfly.frames[self.cur_frame]
 
 
-        n = random.randrange(0,30)
+        n = self.rand.randrange(0,30)
 
         """ grow some mushrooms """
 
@@ -3354,6 +4730,7 @@ class Mosquito(pygame.sprite.Sprite):
 
     def __init__(self, game):
         self.game = game
+        self.rand = game.random_stream('mosquito')
         pygame.sprite.Sprite.__init__(self)
         if Mosquito.frames == None:
             Mosquito.frames = []
@@ -3368,11 +4745,11 @@ class Mosquito(pygame.sprite.Sprite):
         self.frame_delay = self.game.get_ticks()
         self.cur_frame = 0
         
-        start_x = (random.randrange(0,Game.SCREEN_W-1) / \
+        start_x = (self.rand.randrange(0,Game.SCREEN_W-1) / \
         MushroomField.MUSHROOM_WIDTH) * MushroomField.MUSHROOM_WIDTH
         self.rect = pygame.Rect( start_x, 0, Mosquito.WIDTH, Mosquito.HEIGHT )
 
-        n = random.randrange(0,10)
+        n = self.rand.randrange(0,10)
         if n < 5:
             self.dx = -2
         else:
@@ -3391,7 +4768,7 @@ class Mosquito(pygame.sprite.Sprite):
                 self.cur_frame = 0
             self.image = Mosquito.frames[self.cur_frame]
 
-        n = random.randrange(0,30)
+        n = self.rand.randrange(0,30)
 
         if n==5:
             self.dx = -self.dx
@@ -3456,6 +4833,7 @@ class Spider(pygame.sprite.Sprite):
 
     def __init__(self, game):
         self.game = game
+        self.rand = game.random_stream('spider')
         pygame.sprite.Sprite.__init__(self)
         if Spider.frames == None:
             Spider.frames = []
@@ -3471,7 +4849,7 @@ class Spider(pygame.sprite.Sprite):
         self.frame_delay = self.game.get_ticks()
         self.cur_frame = 0
 
-        n = random.randrange(0,10)
+        n = self.rand.randrange(0,10)
         # 50-50 choice in inital start side
         if n < 5:
             self.rect.left = 0 - Spider.WIDTH
@@ -3480,7 +4858,7 @@ class Spider(pygame.sprite.Sprite):
             self.rect.left = Game.SCREEN_W + Spider.WIDTH
             self.dx = -2
 
-        self.rect.top = random.randrange((Game.ARENA_H - Game.PLAYER_H), 
+        self.rect.top = self.rand.randrange((Game.ARENA_H - Game.PLAYER_H), 
                 (Game.ARENA_H - Spider.HEIGHT))
 
         self.enter_arena = True
@@ -3538,7 +4916,7 @@ class Spider(pygame.sprite.Sprite):
 
         elif self.left_right:
             # random left-right motion
-            n = random.randrange(0, 100)
+            n = self.rand.randrange(0, 100)
             # 2% chance to change direction
             if n < 2:
                 self.dx = -self.dx
@@ -3564,7 +4942,7 @@ class Spider(pygame.sprite.Sprite):
                 self.rect.top = (Game.ARENA_H - Game.PLAYER_H)
                 self.dy = -self.dy
         else:
-            n = random.randrange(0, 100)
+            n = self.rand.randrange(0, 100)
             self.rect.top += self.dy
             if self.rect.top > (Game.ARENA_H - Spider.HEIGHT):
                 self.rect.top = (Game.ARENA_H - Spider.HEIGHT)
@@ -3577,7 +4955,7 @@ class Spider(pygame.sprite.Sprite):
                 self.left_right = True
 
         
-        n = random.randrange(0, 100)
+        n = self.rand.randrange(0, 100)
         # 5% chance spider eats a mushroom
         if n < 5:
             # eat mushroom if one is below spider
@@ -3645,6 +5023,7 @@ class DDT(pygame.sprite.Sprite):
 
     def __init__(self, game, x, y):
         self.game = game
+        self.rand = game.random_stream('ddt')
         pygame.sprite.Sprite.__init__(self)
         if DDT.active_frames == None:
             DDT.active_frames = []
@@ -3690,6 +5069,7 @@ class DDT(pygame.sprite.Sprite):
             x2 = x - (DDT.WIDTH/2)
             y2 = y - (DDT.HEIGHT/2)
             self.rect_active.topleft = (x2, y2)
+            self.game.ddts.refile(self)
             # remove DDT if goes above board or into player area
             if (y<0) or (y>=MushroomField.FIELD_PLAYER_Y_POS):
                 self.kill()
@@ -3708,7 +5088,7 @@ class DDT(pygame.sprite.Sprite):
             else: 
                 #if self.cur_frame == DDT.inactive_max_frames:
                 #    self.cur_frame = 0
-                self.cur_frame = random.randrange(0,4)
+                self.cur_frame = self.rand.randrange(0,4)
                 self.image = DDT.inactive_frames[self.cur_frame]
 
         if self.active:
@@ -3736,6 +5116,7 @@ class DDT(pygame.sprite.Sprite):
                 # set rect for pygame collision
                 self.image = DDT.active_frames[0]
                 self.rect = self.rect_active
+                self.game.ddts.refile(self)
                 self.game.stop_ninth_millipede()
             return hit
         else:
@@ -3745,57 +5126,128 @@ class DDT(pygame.sprite.Sprite):
 #####################################################################
 
 
+class TextCache:
+    """Rendered text.
+
+    Single characters are rendered once and composed into strings by
+    compose(). Whole strings come from render(), which keeps the most
+    recently used max_size of them.
+    """
+
+    def __init__(self, font, color=(255,255,255), max_size=64):
+        self.font = font
+        self.color = color
+        self.max_size = max_size
+        self.glyphs = {}
+        self.strings = collections.OrderedDict()
+
+
+    def glyph(self, ch):
+        """Return the rendered character ch."""
+        img = self.glyphs.get(ch)
+        if img == None:
+            img = self.font.render(ch, 1, self.color)
+            self.glyphs[ch] = img
+        return img
+
+
+    def compose(self, buffer, text, pos):
+        """Blit text to buffer at pos one glyph at a time."""
+        x, y = pos
+        for ch in text:
+            img = self.glyph(ch)
+            buffer.blit(img, [x,y])
+            x += img.get_width()
+
+
+    def render(self, text):
+        """Return text rendered as a single surface."""
+        img = self.strings.pop(text, None)
+        if img == None:
+            img = self.font.render(text, 1, self.color)
+            if len(self.strings) >= self.max_size:
+                # forget the least recently used string
+                self.strings.popitem(last=False)
+        self.strings[text] = img
+        return img
+
+#####################################################################
+
+
 class PopUps:
     """PopUps. 
     
     A class to display floating scores.
+
+    The popups live in a ring of POOL preallocated slots. Every popup
+    lasts TTL so the oldest popups are always the first to expire and
+    are swept off the front of the ring in one go.
     """
 
     TTL = 1000
+    # most popups shown at once, the oldest make way for new ones
+    POOL = 64
 
     scores = [1,10,100,200,300,400,500,600,700,800,900,1000,1200]
 
     def __init__(self, game):
         self.game = game
-        self.popups = []
-        self.scores = {}
+        self.text = [None] * PopUps.POOL
+        self.x = array.array('i', [0] * PopUps.POOL)
+        self.y = array.array('i', [0] * PopUps.POOL)
+        self.ttl = array.array('l', [0] * PopUps.POOL)
+        self.first = 0
+        self.count = 0
+        # warm up the text cache with the common scores
         for s in PopUps.scores:
-            self.scores[s] = \
-            self.game.font.render(("%d" % s), 1, (255,255,255))
+            self.game.text.render("%d" % s)
 
 
     def add(self,x,y,score):
         """Add a score to the game board."""
-        p = {}
-        #p['text'] = self.game.font.render( ("%d" % score), 1, (255,255,255))
-        p['score'] = score #self.scores[score]
-        (w,h) = self.scores[score].get_size()
+        text = self.game.text.render("%d" % score)
+        (w,h) = text.get_size()
         tmp_x = x + w
         if x < 0:
-            p['x_pos'] = 0
+            x = 0
         elif tmp_x > Game.SCREEN_W:
-            p['x_pos'] = Game.SCREEN_W - w
-        else:
-            p['x_pos'] = x
+            x = Game.SCREEN_W - w
 
-        p['y_pos'] = y
-        p['ttl'] = self.game.get_ticks()
-        self.popups.append(p)
+        if self.count == PopUps.POOL:
+            self.first = (self.first + 1) % PopUps.POOL
+            self.count -= 1
+        i = (self.first + self.count) % PopUps.POOL
+        self.count += 1
+        self.text[i] = text
+        self.x[i] = x
+        self.y[i] = y
+        self.ttl[i] = self.game.get_ticks()
 
 
     def clear(self):
-        self.popups = []
+        self.first = 0
+        self.count = 0
+
+
+    def expire(self, cur_time):
+        """Sweep the popups older than TTL off the front of the ring."""
+        ttl = self.ttl
+        while self.count and (cur_time - ttl[self.first]) >= PopUps.TTL:
+            self.text[self.first] = None
+            self.first = (self.first + 1) % PopUps.POOL
+            self.count -= 1
 
 
     def draw(self,background):
-        cur_time = self.game.get_ticks()
-        for p in self.popups:
-            t = cur_time - p['ttl']
-            if t < PopUps.TTL:
-                background.blit(self.scores[p['score']],\
-                [p['x_pos'], p['y_pos']])
-            else:
-                self.popups.remove(p)
+        self.expire(self.game.get_ticks())
+        rects = []
+        text = self.text
+        x = self.x
+        y = self.y
+        for k in xrange(self.first, self.first + self.count):
+            i = k % PopUps.POOL
+            rects.append(background.blit(text[i], [x[i], y[i]]))
+        return rects
 
 #####################################################################
 
@@ -3803,15 +5255,27 @@ class Particles:
     """Particles. 
     
     A class to particle effects.
+
+    Like PopUps the particles live in a ring of POOL preallocated
+    slots, in order of age, and expire off the front of the ring.
     """
 
     TTL = 250
     img = None
     MAX = 5
+    # most particles alive at once, the oldest make way for new ones
+    POOL = 512
 
     def __init__(self, game):
         self.game = game
-        self.particles = []
+        self.rand = game.random_stream('particles')
+        self.x = array.array('i', [0] * Particles.POOL)
+        self.y = array.array('i', [0] * Particles.POOL)
+        self.dx = array.array('i', [0] * Particles.POOL)
+        self.dy = array.array('i', [0] * Particles.POOL)
+        self.ttl = array.array('l', [0] * Particles.POOL)
+        self.first = 0
+        self.count = 0
 
         if Particles.img == None:
             Particles.img = pygame.Surface([2,2])
@@ -3819,78 +5283,313 @@ class Particles:
 
     def add(self,x,y):
         """Add n particles to the game board."""
-        n = random.randrange(1,Particles.MAX+1)
+        n = self.rand.randrange(1,Particles.MAX+1)
+        w = 5
+        tmp_x = x + w
+        if x < 0:
+            x = 0
+        elif tmp_x > Game.SCREEN_W:
+            x = Game.SCREEN_W - w
+        ttl = self.game.get_ticks()
         for i in range(0,n): 
-            p = {}
-            w = 5
-            tmp_x = x + w
-            if x < 0:
-                p['x'] = 0
-            elif tmp_x > Game.SCREEN_W:
-                p['x'] = Game.SCREEN_W - w
-            else:
-                p['x'] = x
-            p['y'] = y
-            p['ttl'] = self.game.get_ticks()
-            m = random.randrange(0,10)
+            m = self.rand.randrange(0,10)
             if m == 0:
-                p['dx'] = 0
+                dx = 0
             elif m > 5:
-                p['dx'] = random.randrange(1,3)
+                dx = self.rand.randrange(1,3)
             else:
-                p['dx'] = -random.randrange(1,3)
+                dx = -self.rand.randrange(1,3)
 
-            m = random.randrange(0,10)
+            m = self.rand.randrange(0,10)
             if m == 0:
-                p['dy'] = 0
+                dy = 0
             elif m > 5:
-                p['dy'] = random.randrange(1,3) 
+                dy = self.rand.randrange(1,3) 
             else:
-                p['dy'] = -random.randrange(1,3)
-            self.particles.append(p)
+                dy = -self.rand.randrange(1,3)
+
+            if self.count == Particles.POOL:
+                self.first = (self.first + 1) % Particles.POOL
+                self.count -= 1
+            j = (self.first + self.count) % Particles.POOL
+            self.count += 1
+            self.x[j] = x
+            self.y[j] = y
+            self.dx[j] = dx
+            self.dy[j] = dy
+            self.ttl[j] = ttl
 
 
     def clear(self):
-        self.particles = []
+        self.first = 0
+        self.count = 0
+
+
+    def expire(self, cur_time):
+        """Sweep the particles older than TTL off the front of the ring."""
+        ttl = self.ttl
+        first = self.first
+        count = self.count
+        while count and (cur_time - ttl[first]) >= Particles.TTL:
+            first = (first + 1) % Particles.POOL
+            count -= 1
+        self.first = first
+        self.count = count
 
 
     def update(self):
-        for p in self.particles:
-            p['x'] += p['dx']
-            p['y'] += p['dy']
+        # expire here as well, headless games never draw
+        self.expire(self.game.get_ticks())
+        x = self.x
+        y = self.y
+        dx = self.dx
+        dy = self.dy
+        for k in xrange(self.first, self.first + self.count):
+            i = k % Particles.POOL
+            x[i] += dx[i]
+            y[i] += dy[i]
 
 
     def draw(self,background):
-        cur_time = self.game.get_ticks()
-        for p in self.particles:
-            t = cur_time - p['ttl']
-            if t < Particles.TTL:
-                background.blit(Particles.img, [p['x'], p['y']])
-            else:
-                self.particles.remove(p)
+        self.expire(self.game.get_ticks())
+        rects = []
+        img = Particles.img
+        x = self.x
+        y = self.y
+        for k in xrange(self.first, self.first + self.count):
+            i = k % Particles.POOL
+            rects.append(background.blit(img, [x[i], y[i]]))
+        return rects
 
 
 
 #####################################################################
 
+class NoneSound:
+    """Silent stand-in used when the mixer is unavailable."""
+    def play(self,n=1): pass
+    def stop(self): pass
+
+
+class LoadingSound:
+    """A sound being decoded by a SoundLoader, silent until it is."""
+
+    def __init__(self, name):
+        self.name = name
+        self.sound = None
+
+    def play(self, n=0):
+        sound = self.sound
+        if sound != None:
+            sound.play(n)
+
+    def stop(self):
+        sound = self.sound
+        if sound != None:
+            sound.stop()
+
+
+class StreamedSound:
+    """A sound streamed from its file through pygame.mixer.music.
+
+    There is only one music stream. The streamed sound played last
+    holds it, stopping that sound hands the stream back to the
+    previous one still playing -- see SoundLoader.
+    """
+
+    def __init__(self, loader, name):
+        self.loader = loader
+        self.fullname = os.path.join('data', name)
+        self.loops = 0
+
+    def play(self, n=0):
+        self.loops = n
+        self.loader.stream(self)
+
+    def stop(self):
+        self.loader.unstream(self)
+
+
+class SoundLoader:
+    """Decodes sounds on a background thread.
+
+    load() returns at once, the sound plays as soon as the thread has
+    decoded it. Sounds which fail to load stay silent. Each sound is
+    decoded once, loading it again returns the same sound.
+
+    There is one mixer per process, so there is one SoundLoader too --
+    see shared_sound_loader().
+    """
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.thread = None
+        # sounds by name, decoded or queued
+        self.sounds = {}
+        # streamed sounds playing, the last one holds the stream
+        self.streams = []
+
+
+    def load(self, name, stream=False):
+        """Return sound name, streamed from its file if stream is set."""
+        if not pygame.mixer or not pygame.mixer.get_init():
+            return NoneSound()
+        if stream:
+            return StreamedSound(self, name)
+        if name in self.sounds:
+            return self.sounds[name]
+        sound = LoadingSound(name)
+        self.sounds[name] = sound
+        self.queue.put(sound)
+        if self.thread == None:
+            self.thread = threading.Thread(target=self.run)
+            # never keep the game from exiting
+            self.thread.daemon = True
+            self.thread.start()
+        return sound
+
+
+    def run(self):
+        """Decode queued sounds, forever."""
+        while True:
+            sound = self.queue.get()
+            sound.sound = load_sound(sound.name)
+            self.queue.task_done()
+
+
+    def wait(self):
+        """Wait until every queued sound is decoded."""
+        self.queue.join()
+
+
+    def stream(self, sound):
+        """Start streaming sound."""
+        if sound in self.streams:
+            self.streams.remove(sound)
+        self.streams.append(sound)
+        try:
+            pygame.mixer.music.load(sound.fullname)
+            pygame.mixer.music.play(sound.loops)
+        except pygame.error, message:
+            print "Warning: can not stream sound: ", sound.fullname, message
+
+
+    def unstream(self, sound):
+        """Stop streaming sound, resuming the stream it replaced."""
+        if sound not in self.streams:
+            return
+        playing = (self.streams[-1] is sound)
+        self.streams.remove(sound)
+        if playing:
+            pygame.mixer.music.stop()
+            if self.streams:
+                self.stream(self.streams[-1])
+
+
+    def pause(self):
+        """Pause every sound."""
+        if pygame.mixer.get_init():
+            pygame.mixer.pause()
+            pygame.mixer.music.pause()
+
+
+    def unpause(self):
+        """Resume every paused sound."""
+        if pygame.mixer.get_init():
+            pygame.mixer.unpause()
+            pygame.mixer.music.unpause()
+
+
+    def stop(self):
+        """Stop every sound."""
+        if pygame.mixer.get_init():
+            pygame.mixer.stop()
+            pygame.mixer.music.stop()
+        self.streams = []
+
+
 def load_sound(name):
-    class NoneSound:
-        def play(self,n=1): pass
-        def stop(self): pass
-    if not pygame.mixer:
+    if not pygame.mixer or not pygame.mixer.get_init():
         return NoneSound()
     #return NoneSound()
     fullname = os.path.join('data',name)
     try:
         sound = pygame.mixer.Sound(fullname)
     except pygame.error, message:
-        print "Error: can not load sound: ", fullname
-        raise SystemExit, message
+        # a missing sound is no reason to stop the game
+        print "Warning: can not load sound: ", fullname, message
+        return NoneSound()
     return sound
 
+
+# the SoundLoader of every Game, see shared_sound_loader()
+sound_loader = None
+
+def shared_sound_loader():
+    """Return the SoundLoader, every Game shares the one thread."""
+    global sound_loader
+    if sound_loader == None:
+        sound_loader = SoundLoader()
+    return sound_loader
+
+#####################################################################
+
+
+class Atlas:
+    """The images packed into data/atlas.png by make_atlas.py.
+
+    The atlas is decoded once and converted once, every image is a
+    subsurface view into it.
+    """
+
+    def __init__(self):
+        f = open(os.path.join("data", "atlas.json"))
+        self.places = json.load(f)['images']
+        f.close()
+        self.surface = pygame.image.load(os.path.join("data", "atlas.png"))
+        self.converted = False
+
+
+    def convert(self):
+        """Convert the atlas to the display format, if there is one."""
+        if self.converted or pygame.display.get_surface() == None:
+            return
+        self.surface = self.surface.convert_alpha()
+        self.converted = True
+
+
+    def get(self, name):
+        """Return a view of image name, None if it is not packed."""
+        place = self.places.get(name)
+        if place == None:
+            return None
+        return self.surface.subsurface(place)
+
+
+# the Atlas, see load_atlas()
+atlas = None
+
+def load_atlas():
+    """Load the atlas, the first Game with a display converts it."""
+    global atlas
+    if atlas == None:
+        try:
+            atlas = Atlas()
+        except (IOError, pygame.error), message:
+            print "Warning: no image atlas, run make_atlas.py: ", message
+            return
+    atlas.convert()
+
 def load_image(name):
+    if atlas != None:
+        img = atlas.get(name)
+        if img != None:
+            return img
     fullname = os.path.join("data", name)
     img = pygame.image.load(fullname)
+    # there is no display to convert to when running headless
+    if pygame.display.get_surface() == None:
+        return img
     return img.convert(img)
 
 def mushroom_field_print():
@@ -3899,13 +5598,13 @@ def mushroom_field_print():
         str = ""
         for j in xrange(0, MushroomField.FIELD_WIDTH):
             index = ( i * MushroomField.FIELD_WIDTH ) + j
-            k = game.mushroom_field.m_idx[index]
-            m = game.mushroom_field.m_arr[k]
-            if m['hp'] > 0:
+            mf = game.mushroom_field
+            k = mf.cell(index)
+            if mf.hp[k] > 0:
                 str += "m"
-            elif m['flower']:
+            elif mf.flower[k]:
                 str += "F"
-            elif m['ddt']:
+            elif mf.ddt[k]:
                 str += "D"
             else:
                 str += "."
@@ -3914,5 +5613,70 @@ def mushroom_field_print():
 #####################################################################
 
 if __name__=='__main__':
-    game = Game()
-    game.run()
+    parser = optparse.OptionParser()
+    parser.add_option("--headless", action="store_true", default=False,
+            help="simulate a game without display, sound or throttling")
+    parser.add_option("--frames", type="int", default=0,
+            help="headless only: stop after N frames (default: game over)")
+    parser.add_option("--fixed-timestep", action="store_true",
+            default=False,
+            help="advance game time by 1/60s per frame instead of "
+            "following the wall clock")
+    parser.add_option("--seed", type="int", default=None,
+            help="seed the random number generator of every game")
+    parser.add_option("--record", metavar="FILE",
+            help="record the seed and input of the game to FILE "
+            "(implies --fixed-timestep)")
+    parser.add_option("--replay", metavar="FILE",
+            help="play back a game recorded with --record")
+    parser.add_option("--bot", choices=sorted(BOTS.keys()),
+            help="let a bot play: %s" % ", ".join(sorted(BOTS.keys())))
+    parser.add_option("--dirty-rects", action="store_true", default=False,
+            help="update only the changed parts of the screen instead "
+            "of flipping the whole screen every frame")
+    parser.add_option("--stream-sounds", action="store_true",
+            default=False,
+            help="stream the looping millipede and spider sounds from "
+            "disk instead of decoding them into memory")
+    parser.add_option("--check-counts", action="store_true",
+            default=False,
+            help="debug: check the player area mushroom count against "
+            "a full rescan of the field")
+    parser.add_option("--profile", metavar="FILE",
+            help="time every phase of the last frames of the game and "
+            "write them to FILE on exit, as JSON if FILE ends in .json "
+            "and as CSV otherwise")
+    parser.add_option("--profile-frames", type="int", default=600,
+            help="frames kept by --profile (default: %default)")
+    (options, args) = parser.parse_args()
+    if options.bot and options.replay:
+        parser.error("--bot and --replay both provide the input")
+
+    MushroomField.CHECK_COUNTS = options.check_counts
+
+    game_clock = None
+    seed = options.seed
+    replay = None
+    if options.replay:
+        replay = InputReplay(options.replay)
+        game_clock = VirtualClock(replay.frame_rate)
+        seed = replay.seed
+    elif options.fixed_timestep or options.record:
+        game_clock = VirtualClock()
+
+    game = Game(options.headless, game_clock, seed, options.stream_sounds)
+    game.input_policy = replay
+    if options.bot:
+        game.input_policy = BOTS[options.bot]()
+    game.dirty_rects = options.dirty_rects
+    if options.profile:
+        game.profiler = FrameProfiler(options.profile, options.profile_frames)
+    if options.record:
+        game.recorder = InputRecorder(options.record)
+
+    if options.headless:
+        game.run_headless(options.frames)
+    else:
+        if replay:
+            game.new_game()
+        game.run()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# vim:set sts=4 et sw=4 ts=4 ci ai:
+"""
+make_atlas.py -- pack the Monsters and Mushrooms images into one atlas.
+
+Every PNG in data/sprites and data/images is packed into
+data/atlas.png and its place is written to data/atlas.json. The game
+loads the atlas once at startup and hands out views into it instead
+of decoding each PNG on first use -- see load_image() in game.py.
+
+Run it again whenever an image is added or changed; images missing
+from the atlas are still loaded from their own files.
+
+usage: make_atlas.py [-w WIDTH]
+"""
+
+import glob
+import json
+import optparse
+import os
+
+import pygame
+
+# directories packed, relative to data
+DIRS = ['sprites', 'images']
+# empty pixels around every image
+PADDING = 1
+
+
+def pack(images, width):
+    """Place images, a list of (name, surface), on shelves width pixels
+    wide. Returns the atlas height and a dict of name: [x, y, w, h]."""
+    # tallest images first keeps the shelves full
+    images = sorted(images, key=lambda (name, img): \
+     (-img.get_height(), -img.get_width(), name))
+    places = {}
+    x = y = shelf_h = 0
+    for (name, img) in images:
+        (w, h) = img.get_size()
+        if w + PADDING > width:
+            raise ValueError("%s is wider than the atlas" % name)
+        if x + w + PADDING > width:
+            # start a new shelf
+            x = 0
+            y += shelf_h
+            shelf_h = 0
+        places[name] = [x, y, w, h]
+        x += w + PADDING
+        shelf_h = max(shelf_h, h + PADDING)
+    return (y + shelf_h, places)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-w", "--width", type="int", default=512,
+            help="atlas width in pixels (default: %default)")
+    (options, args) = parser.parse_args()
+
+    images = []
+    for d in DIRS:
+        for path in sorted(glob.glob(os.path.join("data", d, "*.png"))):
+            # names are the ones passed to load_image()
+            name = "%s/%s" % (d, os.path.basename(path))
+            images.append((name, pygame.image.load(path)))
+
+    (height, places) = pack(images, options.width)
+    atlas = pygame.Surface([options.width, height], pygame.SRCALPHA, 32)
+    atlas.fill([0,0,0,0])
+    for (name, img) in images:
+        (x, y, w, h) = places[name]
+        # copy the pixels as they are, alpha included
+        atlas.blit(img, [x,y], None, pygame.BLEND_RGBA_ADD)
+
+    pygame.image.save(atlas, os.path.join("data", "atlas.png"))
+    f = open(os.path.join("data", "atlas.json"), 'w')
+    json.dump({'size' : [options.width, height], 'images' : places}, f,
+     indent=1, sort_keys=True, separators=(',', ': '))
+    f.write("\n")
+    f.close()
+    print "Packed %d images into a %dx%d atlas." % \
+     (len(images), options.width, height)
+
+
+if __name__ == '__main__':
+    # image paths are relative to the game directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    main()